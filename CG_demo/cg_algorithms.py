@@ -5,11 +5,12 @@
 import math
 
 
-def draw_line(p_list, algorithm):
+def draw_line(p_list, algorithm, spans=False):
     """绘制线段
 
     :param p_list: (list of list of int: [[x0, y0], [x1, y1]]) 线段的起点和终点坐标
     :param algorithm: (string) 绘制使用的算法，包括'DDA'和'Bresenham'，此处的'Naive'仅作为示例，测试时不会出现
+    :param spans: (bool) 为True时返回水平区间，见to_spans
     :return: (list of list of int: [[x_0, y_0], [x_1, y_1], [x_2, y_2], ...]) 绘制结果的像素点坐标列表
     """
     x0, y0 = p_list[0]
@@ -99,14 +100,17 @@ def draw_line(p_list, algorithm):
                             x -= 1
                         result.append((int(x), int(y)))
                         p += (2 * x_dis - 2 * y_dis)
+    if spans:
+        return to_spans(result)
     return result
 
 
-def draw_polygon(p_list, algorithm, flag=0):
+def draw_polygon(p_list, algorithm, flag=0, spans=False):
     """绘制多边形
 
     :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 多边形的顶点坐标列表
     :param algorithm: (string) 绘制使用的算法，包括'DDA'和'Bresenham'
+    :param spans: (bool) 为True时返回水平区间，见to_spans
     :return: (list of list of int: [[x_0, y_0], [x_1, y_1], [x_2, y_2], ...]) 绘制结果的像素点坐标列表
     """
     result = []
@@ -118,14 +122,76 @@ def draw_polygon(p_list, algorithm, flag=0):
         for i in range(1, len(p_list)):
             line = draw_line([p_list[i - 1], p_list[i]], algorithm)
             result += line
+    if spans:
+        return to_spans(result)
     return result
 
 
-def draw_ellipse(p_list):
-    """绘制椭圆（采用中点圆生成算法）
+def fill_polygon(p_list, rule='even-odd'):
+    """扫描线填充多边形（边表、活性边表）
+
+    以像素中心所在的水平线y + 0.5为扫描线，像素中心落在多边形内部的像素被填充；
+    交点横坐标用整数增量计算，没有浮点误差，支持凹多边形和自相交多边形
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 多边形的顶点坐标列表
+    :param rule: (string) 填充规则，包括'even-odd'（奇偶规则）和'nonzero'（非零环绕数规则）
+    :return: (list of tuple of int: [(y, x_start, x_end), ...]) 按y递增排列的水平区间，
+             第y行x_start <= x < x_end的像素被填充
+    """
+    if rule not in ('even-odd', 'nonzero'):
+        raise ValueError('未知的填充规则%s' % rule)
+    # 边表：扫描线y -> 从该扫描线开始与之相交的边
+    # 每条边为[结束扫描线(不含), 交点分子, 分子增量, 分母, 方向]，
+    # 交点所在像素列为ceil(分子 / 分母)
+    edge_table = {}
+    for i in range(len(p_list)):
+        xa, ya = p_list[i - 1]
+        xb, yb = p_list[i]
+        if ya == yb:
+            continue
+        direction = 1 if ya < yb else -1
+        if ya > yb:
+            xa, ya, xb, yb = xb, yb, xa, ya
+        dx = xb - xa
+        dy = yb - ya
+        # 扫描线y处交点x = xa + (2(y - ya) + 1) * dx / (2dy)，所在像素列为ceil(x - 0.5)
+        edge_table.setdefault(ya, []).append(
+            [yb, 2 * xa * dy + dx - dy, 2 * dx, 2 * dy, direction])
+    if not edge_table:
+        return []
+
+    result = []
+    active = []
+    y = min(edge_table)
+    y_end = max(e[0] for edges in edge_table.values() for e in edges)
+    while y < y_end:
+        active = [e for e in active if e[0] > y]
+        active.extend(edge_table.get(y, []))
+        crossings = sorted((-(-e[1] // e[3]), e[4]) for e in active)
+        if rule == 'even-odd':
+            for k in range(0, len(crossings) - 1, 2):
+                x_start, x_end = crossings[k][0], crossings[k + 1][0]
+                if x_start < x_end:
+                    result.append((y, x_start, x_end))
+        else:
+            winding = 0
+            for x, direction in crossings:
+                if winding == 0:
+                    x_start = x
+                winding += direction
+                if winding == 0 and x_start < x:
+                    result.append((y, x_start, x))
+        for e in active:
+            e[1] += e[2]
+        y += 1
+    return result
+
+
+def ellipse_box(p_list):
+    """椭圆的中心和轴长，均取两倍以保证是整数
 
     :param p_list: (list of list of int: [[x0, y0], [x1, y1]]) 椭圆的矩形包围框左上角和右下角顶点坐标
-    :return: (list of list of int: [[x_0, y_0], [x_1, y_1], [x_2, y_2], ...]) 绘制结果的像素点坐标列表
+    :return: (int, int, int, int) 两倍的中心坐标cx, cy和两倍的半轴长a, b
     """
     x0, y0 = p_list[0]
     x1, y1 = p_list[1]
@@ -135,51 +201,80 @@ def draw_ellipse(p_list):
         x0, y0, x1, y1 = x1, y0, x0, y1
     elif x0 < x1 and y0 > y1:
         x0, y0, x1, y1 = x0, y1, x1, y0
-    xc = (x0 + x1) / 2
-    yc = (y0 + y1) / 2
-    rx = (x1 - x0) / 2
-    ry = (y1 - y0) / 2
-    result = []
+    return x0 + x1, y0 + y1, x1 - x0, y1 - y0
+
+
+def ellipse_quadrant(a, b):
+    """中点椭圆生成算法，只计算第一象限，只用整数运算
+
+    椭圆宽高为奇数时中心和半轴长是半整数，因此坐标全部取两倍，
+    决策参数取16倍，所有运算都是精确的整数运算
+
+    :param a: (int) 两倍的水平半轴长，即包围框宽度
+    :param b: (int) 两倍的竖直半轴长，即包围框高度
+    :return: (list of tuple of int: [(x_0, y_0), (x_1, y_1), ...]) 第一象限各点相对中心的两倍偏移量
+    """
+    sq_a = a * a
+    sq_b = b * b
     x = 0
-    y = ry
-    result.append([int(xc), int(yc + y)])
-    result.append([int(xc), int(yc - y)])
-    sq_rx = pow(rx, 2)
-    sq_ry = pow(ry, 2)
-    p1 = sq_ry - sq_rx * ry + 1 / 4 * sq_rx
-    while sq_ry * x < sq_rx * y:
+    y = b
+    result = [(0, y)]
+    p1 = 4 * sq_b - 2 * sq_a * b + sq_a
+    while 2 * sq_b * x < sq_a * y:
         x += 1
         if p1 < 0:
-            p1 += 2 * sq_ry * x + sq_ry
+            p1 += 8 * sq_b * x + 4 * sq_b
         else:
-            y -= 1
-            p1 += 2 * sq_ry * x - 2 * sq_rx * y + sq_ry
-
-        result.append([int(xc + x), int(yc + y)])
-        result.append([int(xc - x), int(yc + y)])
-        result.append([int(xc - x), int(yc - y)])
-        result.append([int(xc + x), int(yc - y)])
-    p2 = sq_ry * pow(x + 1 / 2, 2) + sq_rx * pow(y - 1, 2) - sq_rx * sq_ry
+            y -= 2
+            p1 += 8 * sq_b * x - 4 * sq_a * y + 4 * sq_b
+        result.append((2 * x, y))
+    p2 = (sq_b * (2 * x + 1) * (2 * x + 1) + sq_a * (y - 2) * (y - 2) -
+          sq_a * sq_b)
     while y > 0:
-        y -= 1
+        y -= 2
         if p2 >= 0:
-            p2 += (sq_rx - 2 * sq_rx * y)
+            p2 += 4 * sq_a - 4 * sq_a * y
         else:
             x += 1
-            p2 += (2 * sq_ry * x - sq_rx * (2 * y + 1))
-        result.append([int(xc + x), int(yc + y)])
-        result.append([int(xc - x), int(yc + y)])
-        result.append([int(xc - x), int(yc - y)])
-        result.append([int(xc + x), int(yc - y)])
+            p2 += 8 * sq_b * x - 4 * sq_a * (y + 1)
+        result.append((2 * x, y))
+    return result
+
+
+def half(v):
+    """两倍坐标还原为像素坐标，与int(v / 2)一样向零取整"""
+    return v // 2 if v >= 0 else -(-v // 2)
+
 
+def draw_ellipse(p_list, spans=False):
+    """绘制椭圆（采用中点圆生成算法）
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1]]) 椭圆的矩形包围框左上角和右下角顶点坐标
+    :param spans: (bool) 为True时返回水平区间，见to_spans
+    :return: (list of list of int: [[x_0, y_0], [x_1, y_1], [x_2, y_2], ...]) 绘制结果的像素点坐标列表，不含重复点
+    """
+    cx, cy, a, b = ellipse_box(p_list)
+    result = []
+    drawn = set()
+    for x, y in ellipse_quadrant(a, b):
+        # 第一象限的点对称到四个象限，坐标轴上的点只保留一次
+        for p in ((half(cx + x), half(cy + y)), (half(cx - x), half(cy + y)),
+                  (half(cx - x), half(cy - y)), (half(cx + x), half(cy - y))):
+            if p not in drawn:
+                drawn.add(p)
+                result.append([p[0], p[1]])
+    if spans:
+        return to_spans(result)
     return result
 
 
-def draw_curve(p_list, algorithm, flag=0):
+def draw_curve(p_list, algorithm, flag=0, tolerance=None, spans=False):
     """绘制曲线
 
     :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 曲线的控制点坐标列表
     :param algorithm: (string) 绘制使用的算法，包括'Bezier'和'B-sp1ine'（三次均匀B样条曲线，曲线不必经过首末控制点）
+    :param tolerance: (float) Bezier曲线自适应细分的平直度容差（像素），为None时固定取100个采样点
+    :param spans: (bool) 为True时返回水平区间，见to_spans
     :return: (list of list of int: [[x_0, y_0], [x_1, y_1], [x_2, y_2], ...]) 绘制结果的像素点坐标列表
     """
 
@@ -194,30 +289,35 @@ def draw_curve(p_list, algorithm, flag=0):
         py.append(p_list[i][1])
 
     if algorithm == "Bezier":
-        for u in range(0, precision):
-            u = u / precision
-            for i in range(1, n):
-                for j in range(0, n - i):
-                    px[j] = (1 - u) * px[j] + u * px[j + 1]
-                    py[j] = (1 - u) * py[j] + u * py[j + 1]
-            points.append((int(px[0]), int(py[0])))
+        if tolerance is not None:
+            points = bezier_flatten(p_list, tolerance)
+        else:
+            for u in range(0, precision):
+                u = u / precision
+                for i in range(1, n):
+                    for j in range(0, n - i):
+                        px[j] = (1 - u) * px[j] + u * px[j + 1]
+                        py[j] = (1 - u) * py[j] + u * py[j + 1]
+                points.append((int(px[0]), int(py[0])))
         for i in range(0, len(points) - 1):
             line = [points[i], points[i + 1]]
             result.extend(draw_line(line, "DDA"))
     elif algorithm == "B-spline":
-        k = 4
         n = len(p_list)
         if n < 4:
-            return p_list
+            return to_spans(p_list) if spans else p_list
         du = 1 / 1000
-        u = k - 1
+        u = 3
         while u <= n:
+            # u属于区间[j, j + 1)时只有P[j - 3]~P[j]四个控制点的基函数非零，
+            # 用三次均匀B样条的基矩阵直接求出这四个权值，u == n时取最后一段的末端
+            j = min(int(u), n - 1)
+            w = bspline_basis(u - j)
             x, y = 0, 0
-            for i in range(n):
-                x0, y0 = p_list[i]
-                temp = B(i, k, u)
-                x += x0 * temp
-                y += y0 * temp
+            for i in range(4):
+                x0, y0 = p_list[j - 3 + i]
+                x += x0 * w[i]
+                y += y0 * w[i]
             result.append([int(x), int(y)])
             u += du
 
@@ -226,18 +326,123 @@ def draw_curve(p_list, algorithm, flag=0):
             x0, y0, x1, y1 = p[0] - 5, p[1] - 5, p[0] + 5, p[1] + 5
             result.extend(draw_ellipse([[x0, y0], [x1, y1]]))
 
+    if spans:
+        return to_spans(result)
     return result
 
 
-def B(i, k, u):
-    if k == 1:
-        if u >= i and u < i + 1:
-            return 1
+def to_spans(points):
+    """把像素点坐标列表转换为水平区间（行程编码）
+
+    同一行中x连续的像素合并为一个区间，重复的像素只保留一次，因此两种格式表示的像素集合相同，
+    from_spans(to_spans(points))是去重后按y、x排序的points
+
+    :param points: (list of list of int: [[x_0, y_0], [x_1, y_1], ...]) 像素点坐标列表
+    :return: (list of list of int: [[y_0, x_start_0, x_end_0], ...]) 按y、x排序的水平区间，不含x_end
+    """
+    result = []
+    for x, y in sorted(set((p[0], p[1]) for p in points),
+                       key=lambda p: (p[1], p[0])):
+        if result and result[-1][0] == y and result[-1][2] == x:
+            result[-1][2] = x + 1
+        else:
+            result.append([y, x, x + 1])
+    return result
+
+
+def from_spans(spans):
+    """把水平区间展开为像素点坐标列表
+
+    :param spans: (list of list of int: [[y_0, x_start_0, x_end_0], ...]) 水平区间，不含x_end
+    :return: (list of list of int: [[x_0, y_0], [x_1, y_1], ...]) 像素点坐标列表
+    """
+    return [[x, y] for y, x_start, x_end in spans for x in range(x_start, x_end)]
+
+
+# Bezier自适应细分的最大递归深度，最多产生2^BEZIER_MAX_DEPTH段
+BEZIER_MAX_DEPTH = 16
+
+
+def bezier_flatness(ctrl):
+    """Bezier曲线的平直度：内部控制点到首末控制点之间线段的最大距离
+
+    曲线位于控制多边形的凸包内，因此曲线偏离弦的距离不超过该值；控制点在弦所在直线上但超出端点时，
+    曲线会越过端点，因此用到线段而不是到直线的距离
+
+    :param ctrl: (list of tuple of float) 控制点坐标列表
+    :return: (float) 最大距离（像素）
+    """
+    x0, y0 = ctrl[0]
+    x1, y1 = ctrl[-1]
+    dx = x1 - x0
+    dy = y1 - y0
+    length2 = dx * dx + dy * dy
+    d = 0
+    for x, y in ctrl[1:-1]:
+        # 投影参数截断到[0, 1]，投影落在线段外时取到较近端点的距离；首末点重合时即到该点的距离
+        t = 0
+        if length2 > 0:
+            t = min(1, max(0, ((x - x0) * dx + (y - y0) * dy) / length2))
+        d = max(d, math.hypot(x - x0 - t * dx, y - y0 - t * dy))
+    return d
+
+
+def bezier_split(ctrl):
+    """用de Casteljau算法在u = 1/2处把Bezier曲线一分为二
+
+    :param ctrl: (list of tuple of float) 控制点坐标列表
+    :return: (list, list) 前半段和后半段的控制点坐标列表
+    """
+    left = [ctrl[0]]
+    right = [ctrl[-1]]
+    level = ctrl
+    while len(level) > 1:
+        level = [((x0 + x1) / 2, (y0 + y1) / 2)
+                 for (x0, y0), (x1, y1) in zip(level, level[1:])]
+        left.append(level[0])
+        right.append(level[-1])
+    right.reverse()
+    return left, right
+
+
+def bezier_flatten(p_list, tolerance):
+    """自适应细分Bezier曲线，得到折线顶点
+
+    不断把控制多边形对半细分，直到每段的平直度不超过tolerance，
+    采样点数随曲线在屏幕上的长度和弯曲程度变化，而不是固定值
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 曲线的控制点坐标列表
+    :param tolerance: (float) 平直度容差（像素）
+    :return: (list of tuple of int: [(x_0, y_0), (x_1, y_1), ...]) 折线顶点，包括曲线首末端点
+    """
+    ctrl = [(float(p[0]), float(p[1])) for p in p_list]
+    points = [(int(ctrl[0][0]), int(ctrl[0][1]))]
+    stack = [(ctrl, 0)]
+    while stack:
+        ctrl, depth = stack.pop()
+        if depth >= BEZIER_MAX_DEPTH or bezier_flatness(ctrl) <= tolerance:
+            x, y = ctrl[-1]
+            points.append((int(x), int(y)))
         else:
-            return 0
-    else:
-        return (u - i) / (k - 1) * B(i, k - 1, u) + (i + k - u) / (k - 1) * B(
-            i + 1, k - 1, u)
+            left, right = bezier_split(ctrl)
+            stack.append((right, depth + 1))
+            stack.append((left, depth + 1))
+    return points
+
+
+def bspline_basis(t):
+    """三次均匀B样条在一段内的四个基函数值
+
+    即[t^3, t^2, t, 1]乘以基矩阵
+    1/6 * [[-1, 3, -3, 1], [3, -6, 3, 0], [-3, 0, 3, 0], [1, 4, 1, 0]]
+
+    :param t: (float) 段内参数，0 <= t <= 1
+    :return: (list of float) 该段四个控制点的权值
+    """
+    t2 = t * t
+    t3 = t2 * t
+    return [(1 - t) * (1 - t) * (1 - t) / 6, (3 * t3 - 6 * t2 + 4) / 6,
+            (-3 * t3 + 3 * t2 + 3 * t + 1) / 6, t3 / 6]
 
 
 def translate(p_list, dx, dy):
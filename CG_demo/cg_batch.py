@@ -0,0 +1,693 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# 批量（向量化）绘制算法模块
+# cg_algorithms.py只允许依赖math库，依赖numpy的批量实现放在本文件中，
+# 结果与cg_algorithms中对应的逐图元算法逐像素一致
+import math
+import numpy as np
+import cg_algorithms as alg
+
+# 批量绘制时每次处理的线段条数上限，用于限制中间数组的内存占用
+SEGMENT_CHUNK_SIZE = 1 << 14
+# DDA按长度分组补齐后逐行累加，每组补齐后的元素个数上限
+DDA_CHUNK_SIZE = 1 << 20
+# 去重时包围矩形的面积不超过像素个数的该倍数则用位图，否则排序
+BITMAP_MAX_AREA_RATIO = 16
+# draw_preview近似绘制的图元类型，其他类型本身绘制很快，按原算法绘制
+PREVIEW_ITEM_TYPES = ('curve', 'ellipse')
+
+
+def _expand(counts):
+    """把每条线段的像素个数展开为(线段编号, 段内序号)
+
+    :param counts: (numpy.ndarray of int) 每条线段的像素个数
+    :return: (numpy.ndarray, numpy.ndarray) 每个像素所属的线段编号和它在该线段内的序号
+    """
+    starts = np.cumsum(counts) - counts
+    seg = np.repeat(np.arange(len(counts)), counts)
+    j = np.arange(int(counts.sum())) - starts[seg]
+    return seg, j
+
+
+def _draw_lines_dda(x0, y0, x1, y1):
+    """批量DDA，与alg.draw_line(p_list, 'DDA')逐像素一致
+
+    alg.draw_line中坐标是逐步累加xStep/yStep再取整的，浮点误差随步数累积，
+    因此这里同样用按行的cumsum累加，而不是用x0 + i * xStep直接计算
+    """
+    x_dis = x1 - x0
+    y_dis = y1 - y0
+    max_dis = np.maximum(np.abs(x_dis), np.abs(y_dis))
+    counts = np.maximum(max_dis, 1)
+    x_step = x_dis / counts
+    y_step = y_dis / counts
+    starts = np.cumsum(counts) - counts
+    xs = np.empty(int(counts.sum()), np.int64)
+    ys = np.empty_like(xs)
+
+    # 按长度排序后分组，每组补齐到组内最长线段的长度
+    order = np.argsort(counts, kind='stable')
+    lengths = counts[order]
+    n = len(order)
+    a = 0
+    while a < n:
+        b = min(n, a + max(1, DDA_CHUNK_SIZE // int(lengths[a])))
+        b = min(b, a + max(1, DDA_CHUNK_SIZE // int(lengths[b - 1])))
+        rows = order[a:b]
+        width = int(lengths[b - 1])
+        col = np.arange(width)
+        mask = col < counts[rows][:, None]
+        dest = (starts[rows][:, None] + col)[mask]
+        for out, p0, step in ((xs, x0, x_step), (ys, y0, y_step)):
+            acc = np.empty((len(rows), width), np.float64)
+            acc[:, 0] = p0[rows]
+            acc[:, 1:] = step[rows][:, None]
+            np.cumsum(acc, axis=1, out=acc)
+            out[dest] = np.trunc(acc[mask])
+        a = b
+    return xs, ys, counts
+
+
+def _draw_lines_bresenham(x0, y0, x1, y1):
+    """批量Bresenham，与alg.draw_line(p_list, 'Bresenham')逐像素一致
+
+    第j步累计的y增量有闭式解floor((2 * dy * j + dx) / (2 * dx))，
+    与逐步更新决策参数p的结果相同，因此所有像素可以一次算出
+    """
+    swap = x0 > x1
+    x0, y0, x1, y1 = (np.where(swap, x1, x0), np.where(swap, y1, y0),
+                      np.where(swap, x0, x1), np.where(swap, y0, y1))
+    x_dis = x1 - x0
+    y_dis = y1 - y0
+    abs_y = np.abs(y_dis)
+    sign_y = np.sign(y_dis)
+
+    vertical = x_dis == 0
+    horizontal = ~vertical & (y_dis == 0)
+    diagonal = ~vertical & ~horizontal & (abs_y == x_dis)
+    shallow = ~vertical & ~horizontal & ~diagonal & (abs_y < x_dis)
+    steep = ~vertical & ~horizontal & ~diagonal & ~shallow
+
+    # 斜率为±1时alg.draw_line会多画一个点(x1 + 1)，此处保持一致
+    counts = np.where(vertical | steep, abs_y + 1, x_dis + 1) + diagonal
+    seg, j = _expand(counts)
+
+    sx0, sy0, ssy = x0[seg], y0[seg], sign_y[seg]
+    sdx, sady = x_dis[seg], abs_y[seg]
+    xs = sx0 + j
+    ys = sy0 + ssy * j
+
+    case = vertical[seg]
+    xs[case] = sx0[case]
+    ys[case] = np.minimum(sy0, y1[seg])[case] + j[case]
+
+    case = shallow[seg]
+    dx, dy = sdx[case], sady[case]
+    ys[case] = sy0[case] + ssy[case] * ((2 * dy * j[case] + dx) // (2 * dx))
+
+    case = steep[seg]
+    # 陡峭的线段按y从小到大绘制，x的增减方向由斜率符号决定
+    flip = (y_dis < 0)[seg][case]
+    bx0 = np.where(flip, x1[seg][case], sx0[case])
+    by0 = np.where(flip, y1[seg][case], sy0[case])
+    dx, dy = sdx[case], sady[case]
+    ys[case] = by0 + j[case]
+    xs[case] = bx0 + ssy[case] * ((2 * dx * j[case] + dy) // (2 * dy))
+    return xs, ys, counts
+
+
+def draw_lines(segments, algorithm, return_counts=False):
+    """批量绘制线段
+
+    :param segments: (array-like of int, shape (N, 2, 2)) N条线段的起点和终点坐标
+    :param algorithm: (string) 绘制使用的算法，包括'DDA'和'Bresenham'，其他算法逐条调用alg.draw_line
+    :param return_counts: (bool) 为True时额外返回每条线段的像素个数
+    :return: (numpy.ndarray of int32, shape (M, 2)) 所有线段的像素点坐标，按线段顺序首尾相接；
+             return_counts为True时返回(像素点坐标, 每条线段的像素个数)
+    """
+    segments = np.asarray(segments, np.int64).reshape(-1, 2, 2)
+    if algorithm == 'DDA':
+        draw = _draw_lines_dda
+    elif algorithm == 'Bresenham':
+        draw = _draw_lines_bresenham
+    else:
+        lines = [alg.draw_line(s.tolist(), algorithm) for s in segments]
+        counts = np.array([len(line) for line in lines], np.int64)
+        result = np.array([p for line in lines for p in line],
+                          np.int32).reshape(-1, 2)
+        if return_counts:
+            return result, counts
+        return result
+
+    pixels, counts = [], []
+    for i in range(0, len(segments), SEGMENT_CHUNK_SIZE):
+        chunk = segments[i:i + SEGMENT_CHUNK_SIZE]
+        xs, ys, c = draw(chunk[:, 0, 0], chunk[:, 0, 1], chunk[:, 1, 0],
+                         chunk[:, 1, 1])
+        part = np.empty((len(xs), 2), np.int32)
+        part[:, 0] = xs
+        part[:, 1] = ys
+        pixels.append(part)
+        counts.append(c)
+    if pixels:
+        result = np.concatenate(pixels)
+        counts = np.concatenate(counts)
+    else:
+        result = np.empty((0, 2), np.int32)
+        counts = np.empty(0, np.int64)
+    if return_counts:
+        return result, counts
+    return result
+
+
+def draw_line(p_list, algorithm):
+    """绘制线段，返回值为numpy数组的alg.draw_line
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1]]) 线段的起点和终点坐标
+    :param algorithm: (string) 绘制使用的算法，包括'DDA'和'Bresenham'
+    :return: (numpy.ndarray of int32, shape (N, 2)) 绘制结果的像素点坐标
+    """
+    return draw_lines([p_list], algorithm)
+
+
+def polygon_edges(p_list, flag=0):
+    """多边形的边
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 多边形的顶点坐标列表
+    :param flag: (int) 0表示闭合多边形，1表示未闭合的折线（GUI绘制过程中使用）
+    :return: (numpy.ndarray of int64, shape (N, 2, 2)) 边的起点和终点坐标，顺序与alg.draw_polygon一致
+    """
+    points = np.asarray(p_list, np.int64).reshape(-1, 2)
+    if flag == 0:
+        return np.stack([np.roll(points, 1, axis=0), points], axis=1)
+    elif flag == 1:
+        return np.stack([points[:-1], points[1:]], axis=1)
+    return np.empty((0, 2, 2), np.int64)
+
+
+def draw_polygon(p_list, algorithm, flag=0):
+    """绘制多边形，所有边一次批量光栅化
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 多边形的顶点坐标列表
+    :param algorithm: (string) 绘制使用的算法，包括'DDA'和'Bresenham'
+    :return: (numpy.ndarray of int32, shape (N, 2)) 绘制结果的像素点坐标
+    """
+    return draw_lines(polygon_edges(p_list, flag), algorithm)
+
+
+def as_pixels(pixels):
+    """把alg中各绘制函数返回的像素点列表转换为紧凑的numpy数组
+
+    :param pixels: (list of list of int: [[x_0, y_0], [x_1, y_1], ...]) 像素点坐标列表
+    :return: (numpy.ndarray of int32, shape (N, 2)) 像素点坐标
+    """
+    return np.array(pixels, np.int32).reshape(-1, 2)
+
+
+def draw_ellipse(p_list):
+    """绘制椭圆，第一象限用alg.ellipse_quadrant的整数中点算法计算，再用数组运算对称到四个象限
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1]]) 椭圆的矩形包围框左上角和右下角顶点坐标
+    :return: (numpy.ndarray of int32, shape (N, 2)) 绘制结果的像素点坐标，不含重复点，顺序与alg.draw_ellipse一致
+    """
+    cx, cy, a, b = alg.ellipse_box(p_list)
+    quadrant = np.array(alg.ellipse_quadrant(a, b), np.int64)
+    # 每个点依次对称为(+x, +y)、(-x, +y)、(-x, -y)、(+x, -y)
+    signs = np.array([[1, 1], [-1, 1], [-1, -1], [1, -1]], np.int64)
+    doubled = (quadrant[:, None, :] * signs).reshape(-1, 2) + [cx, cy]
+    # 两倍坐标除以2并向零取整
+    pixels = (np.sign(doubled) * (np.abs(doubled) // 2)).astype(np.int32)
+    _, first = np.unique(pixels.view(np.int64).ravel(), return_index=True)
+    return pixels[np.sort(first)]
+
+
+# 三次均匀B样条基矩阵，[t^3, t^2, t, 1] @ BSPLINE_MATRIX为一段内四个控制点的权值
+BSPLINE_MATRIX = np.array([[-1, 3, -3, 1], [3, -6, 3, 0], [-3, 0, 3, 0],
+                           [1, 4, 1, 0]], np.float64) / 6
+
+
+def _draw_bspline(p_list):
+    """向量化的三次均匀B样条，采样点与alg.draw_curve(p_list, 'B-spline')相同
+
+    :param p_list: (list of list of int) 控制点坐标列表，至少4个
+    :return: (numpy.ndarray of int32, shape (N, 2)) 采样点坐标
+    """
+    points = np.asarray(p_list, np.float64).reshape(-1, 2)
+    n = len(points)
+    # 参数u从3开始逐步累加1/1000直到超过n，与alg.draw_curve的浮点累加保持一致
+    acc = np.full((n - 3) * 1000 + 2, 1 / 1000)
+    acc[0] = 3
+    u = np.cumsum(acc)
+    u = u[u <= n]
+    j = np.minimum(u.astype(np.int64), n - 1)
+    t = u - j
+    weights = np.stack([t * t * t, t * t, t, np.ones_like(t)],
+                       axis=1) @ BSPLINE_MATRIX
+    # 每个采样点只用它所在段的四个控制点
+    local = points[(j - 3)[:, None] + np.arange(4)]
+    curve = np.einsum('mk,mkd->md', weights, local)
+    return np.trunc(curve).astype(np.int32)
+
+
+def draw_curve(p_list, algorithm, flag=0, tolerance=None):
+    """绘制曲线，返回值为numpy数组的alg.draw_curve
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 曲线的控制点坐标列表
+    :param algorithm: (string) 绘制使用的算法，包括'Bezier'和'B-spline'
+    :param tolerance: (float) Bezier曲线自适应细分的平直度容差（像素），为None时固定取100个采样点
+    :return: (numpy.ndarray of int32, shape (N, 2)) 绘制结果的像素点坐标
+    """
+    if algorithm == 'B-spline' and len(p_list) >= 4:
+        result = _draw_bspline(p_list)
+        if flag == 1:
+            result = np.concatenate([result] + [
+                draw_ellipse([[x - 5, y - 5], [x + 5, y + 5]])
+                for x, y in p_list
+            ])
+        return result
+    return as_pixels(alg.draw_curve(p_list, algorithm, flag, tolerance))
+
+
+def fill_polygon(p_list, rule='even-odd'):
+    """填充多边形，返回numpy数组
+
+    :param p_list: (list of list of int) 多边形的顶点坐标列表
+    :param rule: (string) 填充规则，包括'even-odd'和'nonzero'
+    :return: (numpy.ndarray of int32, shape (M, 3)) 水平区间(y, x_start, x_end)，不含x_end
+    """
+    return np.array(alg.fill_polygon(p_list, rule), np.int32).reshape(-1, 3)
+
+
+def _unique_codes(code, size):
+    """对编码后的像素去重
+
+    在包围矩形上的位图中标记每个像素，再按位图顺序取出，像素较密时比排序快；
+    包围矩形相对像素个数过大时（例如很长的斜线）位图扫描的开销超过排序，改为排序去重
+
+    :param code: (numpy.ndarray of int64) 像素在包围矩形内的编号，取值在[0, size)内
+    :param size: (int) 包围矩形的面积
+    :return: (numpy.ndarray of int64) 从小到大排列、不含重复的编号
+    """
+    if size <= BITMAP_MAX_AREA_RATIO * len(code):
+        bitmap = np.zeros(size, bool)
+        bitmap[code] = True
+        return np.flatnonzero(bitmap)
+    code = np.sort(code)
+    return code[np.append(True, code[1:] != code[:-1])]
+
+
+def to_spans(pixels):
+    """把像素点坐标转换为水平区间（行程编码），同alg.to_spans
+
+    :param pixels: (numpy.ndarray of int, shape (N, 2)) 像素点坐标
+    :return: (numpy.ndarray of int32, shape (M, 3)) 按y、x排序的水平区间(y, x_start, x_end)，不含x_end
+    """
+    pixels = np.asarray(pixels).reshape(-1, 2)
+    if len(pixels) == 0:
+        return np.empty((0, 3), np.int32)
+    # 把(y, x)编码为一个整数后排序去重，行宽多留一列，使相邻两行的像素不会被当作连续
+    x = pixels[:, 0].astype(np.int64)
+    y = pixels[:, 1].astype(np.int64)
+    x_min, y_min = x.min(), y.min()
+    w = int(x.max() - x_min) + 2
+    code = _unique_codes((y - y_min) * w + (x - x_min),
+                         (int(y.max() - y_min) + 1) * w)
+    start = np.ones(len(code), bool)
+    start[1:] = code[1:] != code[:-1] + 1
+    first = np.flatnonzero(start)
+    last = np.append(first[1:], len(code)) - 1
+    return np.stack([
+        code[first] // w + y_min, code[first] % w + x_min,
+        code[last] % w + x_min + 1
+    ],
+                    axis=1).astype(np.int32)
+
+
+def to_points(spans):
+    """把水平区间展开为像素点坐标，同alg.from_spans
+
+    :param spans: (numpy.ndarray of int, shape (M, 3)) 水平区间(y, x_start, x_end)，不含x_end
+    :return: (numpy.ndarray of int32, shape (N, 2)) 像素点坐标，按区间顺序排列
+    """
+    spans = np.asarray(spans).reshape(-1, 3)
+    seg, j = _expand((spans[:, 2] - spans[:, 1]).clip(0))
+    return np.stack([spans[seg, 1] + j, spans[seg, 0]],
+                    axis=1).astype(np.int32)
+
+
+def compact(raster, unique=False):
+    """选择占用内存较小的表示：水平区间比像素点坐标小时转换为水平区间，否则原样返回
+
+    近似水平的线段、椭圆的上下两段弧和有大量重复采样点的曲线转换后明显变小，
+    陡峭的线段每行只有一两个像素，保持像素点坐标
+
+    :param raster: (numpy.ndarray of int32) 形状为(N, 2)的像素点坐标或形状为(M, 3)的水平区间
+    :param unique: (bool) 为True时保持像素点坐标的结果也去除重复点，按y、x排序
+    :return: (numpy.ndarray of int32) 像素点坐标或水平区间，表示的像素集合不变
+    """
+    if raster.shape[1] == 3 or len(raster) < 2:
+        return raster
+    spans = to_spans(raster)
+    if spans.nbytes < raster.nbytes:
+        return spans
+    return to_points(spans) if unique else raster
+
+
+def draw_item(item_type, p_list, algorithm, flag=0, tolerance=None):
+    """按图元类型绘制，返回numpy数组
+
+    :param item_type: (string) 图元类型，'line'、'polygon'、'ellipse'、'curve'、'fill'
+    :param p_list: (list of list of int) 图元参数
+    :param algorithm: (string) 绘制使用的算法，填充多边形时为填充规则
+    :param flag: (int) 传给draw_polygon和draw_curve的flag
+    :param tolerance: (float) 传给draw_curve的Bezier平直度容差
+    :return: (numpy.ndarray of int32) 形状为(N, 2)的像素点坐标；
+             填充多边形为形状(M, 3)的水平区间(y, x_start, x_end)
+    """
+    if item_type == 'line':
+        return draw_line(p_list, algorithm)
+    elif item_type == 'polygon':
+        return draw_polygon(p_list, algorithm, flag)
+    elif item_type == 'ellipse':
+        return draw_ellipse(p_list)
+    elif item_type == 'curve':
+        return draw_curve(p_list, algorithm, flag, tolerance)
+    elif item_type == 'fill':
+        return fill_polygon(p_list, algorithm)
+    return np.empty((0, 2), np.int32)
+
+
+def _polyline(points, closed=False):
+    """把顶点依次用DDA线段连接
+
+    :param points: (numpy.ndarray of float64, shape (N, 2)) 顶点坐标，截断为整数后连接
+    :param closed: (bool) 是否连接末尾和开头的顶点
+    :return: (numpy.ndarray of int32, shape (M, 2)) 像素点坐标
+    """
+    points = np.trunc(points).astype(np.int64)
+    if closed:
+        edges = np.stack([np.roll(points, 1, axis=0), points], axis=1)
+    else:
+        edges = np.stack([points[:-1], points[1:]], axis=1)
+    return draw_lines(edges, 'DDA')
+
+
+def _curve_samples(p_list, algorithm, samples):
+    """在曲线上均匀取参数采样
+
+    :param p_list: (list of list of int) 控制点坐标列表，B样条至少4个
+    :param algorithm: (string) 'Bezier'或'B-spline'
+    :param samples: (int) B样条每段或整条Bezier曲线的采样间隔数
+    :return: (numpy.ndarray of float64, shape (N, 2)) 曲线上的点
+    """
+    points = np.asarray(p_list, np.float64).reshape(-1, 2)
+    n = len(points)
+    if algorithm == 'B-spline':
+        u = np.linspace(3, n, (n - 3) * samples + 1)
+        j = np.minimum(u.astype(np.int64), n - 1)
+        t = u - j
+        weights = np.stack([t * t * t, t * t, t, np.ones_like(t)],
+                           axis=1) @ BSPLINE_MATRIX
+        local = points[(j - 3)[:, None] + np.arange(4)]
+        return np.einsum('mk,mkd->md', weights, local)
+    # de Casteljau算法，所有采样点同时计算
+    u = np.linspace(0, 1, samples + 1)[:, None, None]
+    level = np.broadcast_to(points, (len(u), n, 2))
+    for _ in range(n - 1):
+        level = (1 - u) * level[:, :-1] + u * level[:, 1:]
+    return level[:, 0]
+
+
+def draw_preview(item_type, p_list, algorithm, samples, flag=0):
+    """拖动图元时使用的近似绘制
+
+    曲线用少量采样点连成的折线代替，椭圆用内接多边形代替，计算量与图元大小和控制点数基本无关；
+    不在PREVIEW_ITEM_TYPES中的图元与draw_item相同
+
+    :param item_type: (string) 图元类型
+    :param p_list: (list of list of int) 图元参数
+    :param algorithm: (string) 绘制使用的算法
+    :param samples: (int) B样条每段、整条Bezier曲线或椭圆每个象限的采样间隔数，越大越接近原算法
+    :param flag: (int) 曲线为1时同时绘制控制点，与draw_curve相同
+    :return: (numpy.ndarray of int32, shape (N, 2)) 像素点坐标
+    """
+    if item_type == 'ellipse':
+        cx, cy, a, b = alg.ellipse_box(p_list)
+        theta = np.linspace(0, 2 * math.pi, 4 * samples, endpoint=False)
+        # ellipse_box的中心和半轴长都是两倍值
+        return _polyline(np.stack([cx + a * np.cos(theta), cy + b * np.sin(theta)],
+                                  axis=1) / 2,
+                         closed=True)
+    elif item_type == 'curve' and (algorithm != 'B-spline'
+                                   or len(p_list) >= 4):
+        result = _polyline(_curve_samples(p_list, algorithm, samples))
+        if flag == 1:
+            result = np.concatenate([result] + [
+                draw_ellipse([[x - 5, y - 5], [x + 5, y + 5]])
+                for x, y in p_list
+            ])
+        return result
+    return draw_item(item_type, p_list, algorithm, flag)
+
+
+def _encode(x, y, x_min, y_min, x_max, y_max):
+    """批量计算Cohen-Sutherland区域码，编码方式同alg.encode"""
+    return (((y > y_max) << 3) | ((y < y_min) << 2) | ((x > x_max) << 1) |
+            (x < x_min)).astype(np.int64)
+
+
+def _inter_point(border, x1, y1, x2, y2):
+    """批量计算与竖直边界x = border的交点，同alg.inter_point
+
+    交点不在线段上时保持(x1, y1)不变
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = (border - x1) / (x2 - x1)
+    valid = (u >= 0) & (u <= 1)
+    return (np.where(valid, border, x1),
+            np.where(valid, np.trunc(y1 + u * (y2 - y1)), y1))
+
+
+def _clip_cohen_sutherland(x1, y1, x2, y2, x_min, y_min, x_max, y_max):
+    """批量Cohen-Sutherland裁剪，每条线段的处理步骤与alg.clip相同（最多4轮）"""
+    active = np.ones(len(x1), bool)
+    keep = np.ones(len(x1), bool)
+    for _ in range(4):
+        c1 = _encode(x1, y1, x_min, y_min, x_max, y_max)
+        c2 = _encode(x2, y2, x_min, y_min, x_max, y_max)
+        # 两端都在窗口内时接受，两端在窗口同一侧时拒绝
+        rejected = active & ((c1 & c2) != 0)
+        keep[rejected] = False
+        active &= ((c1 & c2) == 0) & ((c1 | c2) != 0)
+        if not active.any():
+            break
+        # 保证(x1, y1)在窗口外
+        swap = active & (c1 == 0)
+        x1, y1, x2, y2 = (np.where(swap, x2, x1), np.where(swap, y2, y1),
+                          np.where(swap, x1, x2), np.where(swap, y1, y2))
+        # 与alg.clip一致，交换后沿用原端点的区域码（为0），本轮不再求交
+        left = active & ((c1 & 1) != 0)
+        right = active & ~left & ((c1 & 2) != 0)
+        down = active & ~left & ~right & ((c1 & 4) != 0)
+        up = active & ~left & ~right & ~down & ((c1 & 8) != 0)
+        for mask, border, vertical in ((left, x_min, True),
+                                       (right, x_max, True),
+                                       (down, y_min, False),
+                                       (up, y_max, False)):
+            if not mask.any():
+                continue
+            if vertical:
+                nx, ny = _inter_point(border[mask], x1[mask], y1[mask],
+                                      x2[mask], y2[mask])
+            else:
+                ny, nx = _inter_point(border[mask], y1[mask], x1[mask],
+                                      y2[mask], x2[mask])
+            x1[mask] = nx
+            y1[mask] = ny
+    else:
+        # 4轮后仍未结束的线段按此时的区域码判断是否保留
+        c1 = _encode(x1, y1, x_min, y_min, x_max, y_max)
+        c2 = _encode(x2, y2, x_min, y_min, x_max, y_max)
+        keep[active & ((c1 & c2) != 0)] = False
+    return x1, y1, x2, y2, keep
+
+
+def _clip_liang_barsky(x1, y1, x2, y2, x_min, y_min, x_max, y_max):
+    """批量Liang-Barsky裁剪，与alg.clip相同"""
+    dx = x2 - x1
+    dy = y2 - y1
+    u1 = np.zeros(len(x1))
+    u2 = np.ones(len(x1))
+    keep = np.ones(len(x1), bool)
+    for p, q in ((-dx, x1 - x_min), (dx, x_max - x1), (-dy, y1 - y_min),
+                 (dy, y_max - y1)):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = q / p
+        keep &= ~((p == 0) & (q < 0))
+        u1 = np.where(keep & (p < 0), np.maximum(u1, r), u1)
+        u2 = np.where(keep & (p > 0), np.minimum(u2, r), u2)
+        keep &= u1 <= u2
+    new_x2 = np.where(keep & (u2 < 1), x1 + u2 * dx, x2)
+    new_y2 = np.where(keep & (u2 < 1), y1 + u2 * dy, y2)
+    new_x1 = np.where(keep & (u1 > 0), x1 + u1 * dx, x1)
+    new_y1 = np.where(keep & (u1 > 0), y1 + u1 * dy, y1)
+    return new_x1, new_y1, new_x2, new_y2, keep
+
+
+def clip_many(segments, window, algorithm):
+    """批量线段裁剪
+
+    :param segments: (array-like of int, shape (N, 2, 2)) N条线段的起点和终点坐标
+    :param window: (tuple: (x_min, y_min, x_max, y_max)) 裁剪窗口，
+                   也可以是形状为(N, 4)的数组，为每条线段分别指定窗口
+    :param algorithm: (string) 使用的裁剪算法，包括'Cohen-Sutherland'和'Liang-Barsky'
+    :return: (numpy.ndarray of int64, shape (N, 2, 2), numpy.ndarray of bool, shape (N,))
+             裁剪后线段的起点和终点坐标，以及线段是否有部分在窗口内；
+             保留的线段与alg.clip的结果相同，不保留的线段坐标不变
+    """
+    segments = np.asarray(segments, np.float64).reshape(-1, 2, 2)
+    window = np.broadcast_to(np.asarray(window, np.float64),
+                             (len(segments), 4))
+    x1, y1 = segments[:, 0, 0].copy(), segments[:, 0, 1].copy()
+    x2, y2 = segments[:, 1, 0].copy(), segments[:, 1, 1].copy()
+    bounds = window[:, 0], window[:, 1], window[:, 2], window[:, 3]
+    if algorithm == 'Cohen-Sutherland':
+        x1, y1, x2, y2, keep = _clip_cohen_sutherland(x1, y1, x2, y2, *bounds)
+    elif algorithm == 'Liang-Barsky':
+        x1, y1, x2, y2, keep = _clip_liang_barsky(x1, y1, x2, y2, *bounds)
+    else:
+        raise ValueError('未知的裁剪算法%s' % algorithm)
+    result = np.stack([np.stack([x1, y1], axis=1),
+                       np.stack([x2, y2], axis=1)], axis=1)
+    result = np.where(keep[:, None, None], np.trunc(result), segments)
+    return result.astype(np.int64), keep
+
+
+def translate_matrix(dx, dy):
+    """平移变换的仿射矩阵
+
+    仿射变换p' = A(p - o) + t用元组(a, b, d, e, ox, oy, tx, ty)表示，其中A = [[a, b], [d, e]]，
+    o为变换中心。保留变换中心使单次变换的浮点运算顺序与alg中逐点计算的公式完全相同，
+    截断后的结果也相同；变换指令只涉及几个标量，用元组比numpy小数组快得多
+
+    :param dx: (int) 水平方向平移量
+    :param dy: (int) 垂直方向平移量
+    :return: (tuple of float) 仿射矩阵
+    """
+    return 1.0, 0.0, 0.0, 1.0, 0, 0, dx, dy
+
+
+def rotate_matrix(x, y, r):
+    """旋转变换的仿射矩阵，与alg.rotate相同
+
+    :param x: (int) 旋转中心x坐标
+    :param y: (int) 旋转中心y坐标
+    :param r: (float) 顺时针旋转角度（°）
+    :return: (tuple of float) 仿射矩阵
+    """
+    h = math.radians(r)
+    c, s = math.cos(h), math.sin(h)
+    return c, -s, s, c, x, y, x, y
+
+
+def scale_matrix(x, y, s):
+    """缩放变换的仿射矩阵，与alg.scale相同
+
+    :param x: (int) 缩放中心x坐标
+    :param y: (int) 缩放中心y坐标
+    :param s: (float) 缩放倍数
+    :return: (tuple of float) 仿射矩阵
+    """
+    return s, 0.0, 0.0, s, 0, 0, x * (1 - s), y * (1 - s)
+
+
+def compose(m2, m1):
+    """仿射矩阵复合，先作用m1再作用m2
+
+    m2(m1(p)) = A2(A1(p - o1) + t1 - o2) + t2 = A2A1(p - o1) + A2(t1 - o2) + t2
+
+    :param m2: (tuple of float) 后作用的仿射矩阵
+    :param m1: (tuple of float) 先作用的仿射矩阵
+    :return: (tuple of float) 复合后的仿射矩阵，变换中心为m1的变换中心
+    """
+    a2, b2, d2, e2, ox2, oy2, tx2, ty2 = m2
+    a1, b1, d1, e1, ox1, oy1, tx1, ty1 = m1
+    ux, uy = tx1 - ox2, ty1 - oy2
+    return (a2 * a1 + b2 * d1, a2 * b1 + b2 * e1, d2 * a1 + e2 * d1,
+            d2 * b1 + e2 * e1, ox1, oy1, a2 * ux + b2 * uy + tx2,
+            d2 * ux + e2 * uy + ty2)
+
+
+def stack_points(p_lists):
+    """把多个图元的参数首尾相接放进一个数组
+
+    :param p_lists: (list of list of list of int) 各图元的参数
+    :return: (numpy.ndarray of float64, shape (N, 2), list of int) 所有图元的顶点坐标，每个图元的顶点个数
+    """
+    counts = [len(p_list) for p_list in p_lists]
+    if sum(counts) == 0:
+        return np.empty((0, 2), np.float64), counts
+    points = np.concatenate(
+        [np.asarray(p_list, np.float64).reshape(-1, 2) for p_list in p_lists])
+    return points, counts
+
+
+def transform_points(points, matrix):
+    """对顶点作用仿射矩阵
+
+    :param points: (numpy.ndarray of float64, shape (N, 2)) 顶点坐标
+    :param matrix: (tuple of float) 作用于所有顶点的仿射矩阵，格式见translate_matrix；
+                   也可以是形状为(N, 8)的数组，每个顶点一个矩阵
+    :return: (numpy.ndarray of float64, shape (N, 2)) 变换后的坐标，未截断为整数
+    """
+    a, b, d, e, ox, oy, tx, ty = np.asarray(matrix, np.float64).T
+    dx = points[:, 0] - ox
+    dy = points[:, 1] - oy
+    # 运算顺序与alg.rotate、alg.scale中的公式一致
+    return np.stack([tx + a * dx + b * dy, ty + d * dx + e * dy], axis=1)
+
+
+def split_points(points, counts):
+    """把顶点坐标截断为整数，再按每个图元的顶点个数拆回各图元的参数
+
+    :param points: (numpy.ndarray of float64, shape (N, 2)) stack_points叠放的顶点坐标
+    :param counts: (list of int) 每个图元的顶点个数
+    :return: (list of list of list of int) 各图元的参数
+    """
+    result = np.trunc(points).astype(np.int64).tolist()
+    starts = np.cumsum(counts) - counts
+    return [result[a:a + n] for a, n in zip(starts, counts)]
+
+
+def transform_group(p_lists, matrix):
+    """对多个图元作用同一个仿射矩阵
+
+    所有顶点叠放在一个数组中一次计算，三角函数只在生成矩阵时计算一次；
+    结果与对每个图元分别调用alg.translate、alg.rotate、alg.scale相同
+
+    :param p_lists: (list of list of list of int) 各图元的参数
+    :param matrix: (tuple of float) 仿射矩阵，格式见translate_matrix
+    :return: (list of list of list of int) 变换后的各图元参数
+    """
+    points, counts = stack_points(p_lists)
+    return split_points(transform_points(points, matrix), counts)
+
+
+def apply_transforms(p_lists, matrices):
+    """把累积的仿射矩阵一次性作用到多个图元上
+
+    与逐条调用alg.translate、alg.rotate、alg.scale不同，坐标只在最后截断为整数一次，
+    多次旋转、缩放不会累积截断误差；单次变换和只含整数平移时结果与逐条调用相同
+
+    :param p_lists: (list of list of list of int) 各图元的参数
+    :param matrices: (list of tuple of float) 与p_lists一一对应的仿射矩阵
+    :return: (list of list of list of int) 变换后的各图元参数
+    """
+    points, counts = stack_points(p_lists)
+    if len(points) == 0:
+        return [[] for _ in p_lists]
+    owner = np.repeat(np.arange(len(p_lists)), counts)
+    return split_points(
+        transform_points(points,
+                         np.asarray(matrices, np.float64)[owner]), counts)
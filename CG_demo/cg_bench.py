@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# 算法性能测试：按输入规模测量各算法的耗时，结果写入JSON并可与基线比较
+import sys
+import json
+import math
+import time
+import random
+import platform
+import argparse
+from collections import namedtuple
+import numpy as np
+import cg_algorithms as alg
+import cg_batch
+
+# 默认重复次数，取最快的一次
+DEFAULT_REPEAT = 5
+# 默认回归阈值：单个图元耗时比基线慢超过该比例即视为性能回归
+DEFAULT_THRESHOLD = 0.2
+# 固定随机种子，使每次运行的输入相同
+SEED = 2020
+
+# 一个测试项
+# name: 测试项名称，作为与基线比较时的键
+# group: 被测函数
+# size: 输入规模
+# count: 每次运行处理的图元个数
+# run: 无参数的被测函数，返回产生的像素个数，不产生像素的测试项返回None
+Case = namedtuple('Case', 'name group size count run')
+
+
+def random_segments(rng, count, length):
+    """生成长度约为length、方向随机的线段
+
+    :param rng: (random.Random) 随机数生成器
+    :param count: (int) 线段条数
+    :param length: (int) 线段长度
+    :return: (list of list of list of int) 线段列表
+    """
+    result = []
+    for _ in range(count):
+        x0, y0 = rng.randint(0, 1000), rng.randint(0, 1000)
+        h = rng.uniform(0, 2 * math.pi)
+        result.append([[x0, y0],
+                       [
+                           x0 + int(length * math.cos(h)),
+                           y0 + int(length * math.sin(h))
+                       ]])
+    return result
+
+
+def random_points(rng, count, extent=1000):
+    return [[rng.randint(0, extent), rng.randint(0, extent)]
+            for _ in range(count)]
+
+
+def _each(func, inputs, *args):
+    """逐个调用func，返回产生的像素总数"""
+    def run():
+        return sum(len(func(p_list, *args)) for p_list in inputs)
+
+    return run
+
+
+def line_cases(rng):
+    for algorithm in ['Naive', 'DDA', 'Bresenham']:
+        for length in [16, 64, 256, 1024]:
+            segments = random_segments(rng, 100, length)
+            yield Case('draw_line/%s/length=%d' % (algorithm, length),
+                       'draw_line', length, len(segments),
+                       _each(alg.draw_line, segments, algorithm))
+        for count in [100, 1000, 10000]:
+            segments = np.array(random_segments(rng, count, 64))
+            yield Case(
+                'draw_lines/%s/batch=%d' % (algorithm, count), 'draw_lines',
+                count, count,
+                lambda segments=segments, algorithm=algorithm: len(
+                    cg_batch.draw_lines(segments, algorithm)))
+
+
+def ellipse_cases(rng):
+    for radius in [8, 32, 128, 512]:
+        boxes = []
+        for _ in range(20):
+            x, y = rng.randint(0, 1000), rng.randint(0, 1000)
+            ry = rng.randint(radius // 2, radius)
+            boxes.append([[x - radius, y - ry], [x + radius, y + ry]])
+        yield Case('draw_ellipse/radius=%d' % radius, 'draw_ellipse', radius,
+                   len(boxes), _each(alg.draw_ellipse, boxes))
+        yield Case('batch_ellipse/radius=%d' % radius, 'batch_ellipse',
+                   radius, len(boxes), _each(cg_batch.draw_ellipse, boxes))
+
+
+def curve_cases(rng):
+    for algorithm, sizes in [('Bezier', [3, 5, 8, 10]),
+                             ('B-spline', [4, 8, 16, 32])]:
+        for n in sizes:
+            curves = [random_points(rng, n) for _ in range(10)]
+            yield Case('draw_curve/%s/points=%d' % (algorithm, n),
+                       'draw_curve', n, len(curves),
+                       _each(alg.draw_curve, curves, algorithm))
+            yield Case('batch_curve/%s/points=%d' % (algorithm, n),
+                       'batch_curve', n, len(curves),
+                       _each(cg_batch.draw_curve, curves, algorithm))
+
+
+def clip_cases(rng):
+    window = (250, 250, 750, 750)
+    for algorithm in ['Cohen-Sutherland', 'Liang-Barsky']:
+        for count in [100, 1000, 10000]:
+            segments = [[p0, p1] for p0, p1 in zip(
+                random_points(rng, count), random_points(rng, count))]
+
+            def run(segments=segments, algorithm=algorithm):
+                for p_list in segments:
+                    alg.clip(p_list, *window, algorithm)
+
+            yield Case('clip/%s/batch=%d' % (algorithm, count), 'clip',
+                       count, count, run)
+
+            def run_many(array=np.array(segments), algorithm=algorithm):
+                cg_batch.clip_many(array, window, algorithm)
+
+            yield Case('clip_many/%s/batch=%d' % (algorithm, count),
+                       'clip_many', count, count, run_many)
+
+
+def transform_cases(rng):
+    for n in [4, 64, 1024]:
+        polygons = [random_points(rng, n) for _ in range(20)]
+        for name, func, args in [('translate', alg.translate, (3, -5)),
+                                 ('rotate', alg.rotate, (500, 500, 30)),
+                                 ('scale', alg.scale, (500, 500, 1.5))]:
+
+            def run(func=func, args=args, polygons=polygons):
+                for p_list in polygons:
+                    func(p_list, *args)
+
+            yield Case('%s/points=%d' % (name, n), name, n, len(polygons),
+                       run)
+
+        def run_batch(polygons=polygons):
+            matrix = cg_batch.rotate_matrix(500, 500, 30)
+            cg_batch.apply_transforms(polygons, [matrix] * len(polygons))
+
+        yield Case('apply_transforms/points=%d' % n, 'apply_transforms', n,
+                   len(polygons), run_batch)
+
+
+# 测试项生成函数，每个函数使用独立的随机数生成器，增删测试项不影响其他测试项的输入
+CASE_GROUPS = [
+    line_cases, ellipse_cases, curve_cases, clip_cases, transform_cases
+]
+
+
+def measure(case, repeat):
+    """测量一个测试项
+
+    :param case: (Case) 测试项
+    :param repeat: (int) 重复次数，取最快的一次
+    :return: (dict) 测量结果
+    """
+    best = math.inf
+    pixels = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pixels = case.run()
+        best = min(best, time.perf_counter() - start)
+    return {
+        'group': case.group,
+        'size': case.size,
+        'count': case.count,
+        'seconds': best,
+        'per_primitive': best / case.count,
+        'pixels': pixels,
+        'pixels_per_second': pixels / best if pixels and best > 0 else None,
+    }
+
+
+def run_benchmarks(repeat=DEFAULT_REPEAT, pattern=''):
+    """运行所有名称包含pattern的测试项
+
+    :param repeat: (int) 每个测试项的重复次数
+    :param pattern: (string) 只运行名称包含该字符串的测试项
+    :return: (dict) 测试项名称 -> 测量结果
+    """
+    results = {}
+    for group in CASE_GROUPS:
+        for case in group(random.Random(SEED)):
+            if pattern in case.name:
+                results[case.name] = measure(case, repeat)
+                print_result(case.name, results[case.name])
+    return results
+
+
+def print_result(name, result):
+    rate = result['pixels_per_second']
+    print('%-44s %12.2fus/个 %16s' %
+          (name, result['per_primitive'] * 1e6,
+           '%.3g像素/s' % rate if rate else '-'))
+
+
+def compare(results, baseline, threshold):
+    """与基线比较单个图元的耗时
+
+    :param results: (dict) 本次的测量结果
+    :param baseline: (dict) 基线的测量结果
+    :param threshold: (float) 回归阈值
+    :return: (list of tuple) 性能回归的测试项(名称, 基线耗时, 本次耗时)
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]['per_primitive']
+        new = result['per_primitive']
+        if new > old * (1 + threshold):
+            regressions.append((name, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='cg_algorithms和cg_batch性能测试')
+    parser.add_argument('--output', help='测量结果写入的JSON文件')
+    parser.add_argument('--baseline', help='作为基线的JSON文件，由之前的--output生成')
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=DEFAULT_THRESHOLD,
+                        help='回归阈值，单个图元耗时比基线慢超过该比例时报告回归，默认为0.2')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=DEFAULT_REPEAT,
+                        help='每个测试项的重复次数，取最快的一次，默认为5')
+    parser.add_argument('--filter',
+                        default='',
+                        help='只运行名称包含该字符串的测试项，例如draw_line/DDA')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat, args.filter)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(
+                {
+                    'meta': {
+                        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                        'python': platform.python_version(),
+                        'numpy': np.__version__,
+                        'platform': platform.platform(),
+                        'repeat': args.repeat,
+                    },
+                    'results': results
+                },
+                fp,
+                indent=2,
+                ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, old, new in regressions:
+            print('性能回归 %s: %.2fus -> %.2fus (+%.0f%%)' %
+                  (name, old * 1e6, new * 1e6, (new / old - 1) * 100))
+        print('与基线比较%d项，%d项回归' %
+              (len(set(results) & set(baseline)), len(regressions)))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
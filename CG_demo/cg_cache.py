@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# 光栅化结果缓存，CLI和GUI共用
+from collections import OrderedDict
+import cg_batch
+
+# 默认缓存容量（字节）
+DEFAULT_MAX_BYTES = 64 << 20
+
+
+class RasterCache:
+    """
+    以几何参数为键的LRU光栅化缓存
+
+    键为(图元类型, 规范化的p_list, 算法, flag, 容差, 是否去重)，值为cg_batch返回的只读像素点数组或水平区间数组。
+    键由调用时的p_list内容生成，图元被平移、旋转、缩放或裁剪后键随之改变，因此不会取到过期的像素
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """
+
+        :param max_bytes: (int) 缓存中数组占用内存的上限（字节）
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(item_type,
+            p_list,
+            algorithm='',
+            flag=0,
+            tolerance=None,
+            unique=False):
+        """生成缓存键
+
+        椭圆只有一种算法，线段、椭圆和填充多边形没有flag，只有Bezier曲线使用tolerance，这些无关参数不参与比较，
+        使CLI中残留的algorithm等取值不会造成无谓的缓存未命中
+
+        :param item_type: (string) 图元类型，'line'、'polygon'、'ellipse'、'curve'、'fill'
+        :param p_list: (list of list of int) 图元参数
+        :param algorithm: (string) 绘制使用的算法，填充多边形时为填充规则
+        :param flag: (int) 传给draw_polygon和draw_curve的flag
+        :param tolerance: (float) 传给draw_curve的Bezier平直度容差
+        :param unique: (bool) 像素点坐标是否去除了重复点，见cg_batch.compact
+        :return: (tuple) 缓存键
+        """
+        points = tuple((p[0], p[1]) for p in p_list)
+        if item_type == 'ellipse':
+            algorithm = ''
+        if item_type in ('line', 'ellipse', 'fill'):
+            flag = 0
+        if item_type != 'curve' or algorithm != 'Bezier':
+            tolerance = None
+        return item_type, points, algorithm, flag, tolerance, bool(unique)
+
+    def get(self, key):
+        """查询缓存
+
+        :param key: (tuple) RasterCache.key生成的缓存键
+        :return: (numpy.ndarray of int32) 像素点坐标或水平区间，未命中时返回None
+        """
+        pixels = self._entries.get(key)
+        if pixels is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return pixels
+
+    def put(self, key, pixels):
+        """写入缓存，超出容量时淘汰最久未使用的项
+
+        :param key: (tuple) RasterCache.key生成的缓存键
+        :param pixels: (numpy.ndarray of int32) 像素点坐标或水平区间，写入后被设为只读
+        """
+        if pixels.nbytes > self.max_bytes:
+            return
+        pixels.flags.writeable = False
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self._entries[key] = pixels
+        self.nbytes += pixels.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def draw(self,
+             item_type,
+             p_list,
+             algorithm='',
+             flag=0,
+             tolerance=None,
+             unique=False):
+        """带缓存的cg_batch.draw_item，结果经过cg_batch.compact
+
+        :param item_type: (string) 图元类型，'line'、'polygon'、'ellipse'、'curve'、'fill'
+        :param p_list: (list of list of int) 图元参数
+        :param algorithm: (string) 绘制使用的算法
+        :param flag: (int) 传给draw_polygon和draw_curve的flag
+        :param tolerance: (float) 传给draw_curve的Bezier平直度容差
+        :param unique: (bool) 为True时像素点坐标不含重复点
+        :return: (numpy.ndarray of int32) 只读的像素点坐标或水平区间
+        """
+        key = self.key(item_type, p_list, algorithm, flag, tolerance, unique)
+        pixels = self.get(key)
+        if pixels is None:
+            pixels = cg_batch.compact(
+                cg_batch.draw_item(item_type, p_list, algorithm, flag,
+                                   tolerance), unique)
+            self.put(key, pixels)
+        return pixels
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """缓存统计
+
+        :return: (dict) 命中次数、未命中次数、缓存项数和占用字节数
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self.nbytes
+        }
+
+
+# CLI和GUI默认共用的缓存
+raster_cache = RasterCache()
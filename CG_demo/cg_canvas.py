@@ -0,0 +1,597 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# CLI使用的帧缓冲
+import os
+import mmap
+import struct
+import weakref
+import tempfile
+from multiprocessing import shared_memory
+import numpy as np
+import cg_batch
+
+# 脏区域个数超过该值时合并为一个包围矩形
+MAX_DIRTY_RECTS = 16
+# 脏区域面积超过画布面积的该比例时直接整幅重绘
+FULL_REDRAW_RATIO = 0.5
+# 水平区间的平均长度不小于该值时逐行切片写入，否则展开为像素点一次写入
+SPAN_SLICE_MIN_LENGTH = 32
+# 保存BMP时每次转换并写出的字节数上限
+BMP_BAND_BYTES = 16 << 20
+# BMP的水平和垂直分辨率（像素/米），与Pillow默认的96 dpi相同
+BMP_PIXELS_PER_METER = 3780
+# 内存映射的帧缓冲累计写入或读出超过该字节数后，把已换入的页交还给操作系统
+MMAP_RELEASE_BYTES = 64 << 20
+# 分块并行绘制时图块的边长（像素）
+TILE_SIZE = 2048
+# 有进程池且画布像素数不少于该值时，整幅重绘分块并行进行
+TILED_MIN_PIXELS = 1 << 22
+
+
+def is_spans(raster):
+    """光栅化结果是否为水平区间
+
+    :param raster: (numpy.ndarray of int) 形状为(N, 2)的像素点坐标或形状为(M, 3)的水平区间(y, x_start, x_end)
+    :return: (bool) 是否为水平区间
+    """
+    return raster.shape[1] == 3
+
+
+def clip_spans(spans, x_min, y_min, x_max, y_max):
+    """把水平区间裁剪到矩形内
+
+    :param spans: (numpy.ndarray of int, shape (M, 3)) 水平区间(y, x_start, x_end)，不含x_end
+    :param x_min: (int) 矩形左边界
+    :param y_min: (int) 矩形上边界
+    :param x_max: (int) 矩形右边界（不含）
+    :param y_max: (int) 矩形下边界（不含）
+    :return: (numpy.ndarray of int, shape (K, 3)) 裁剪后非空的水平区间
+    """
+    y = spans[:, 0]
+    x_start = np.maximum(spans[:, 1], x_min)
+    x_end = np.minimum(spans[:, 2], x_max)
+    keep = (y >= y_min) & (y < y_max) & (x_start < x_end)
+    return np.stack([y[keep], x_start[keep], x_end[keep]], axis=1)
+
+
+def pixel_count(raster):
+    """光栅化结果包含的像素个数
+
+    :param raster: (numpy.ndarray of int) 形状为(N, 2)的像素点坐标或形状为(M, 3)的水平区间
+    :return: (int) 像素个数
+    """
+    if is_spans(raster):
+        return int((raster[:, 2] - raster[:, 1]).sum())
+    return len(raster)
+
+
+def bounding_box(raster):
+    """光栅化结果的包围矩形
+
+    :param raster: (numpy.ndarray of int) 形状为(N, 2)的像素点坐标或形状为(M, 3)的水平区间
+    :return: (tuple of int: (x_min, y_min, x_max, y_max)) 包围矩形，右下角不含在内；没有像素点时返回None
+    """
+    if len(raster) == 0:
+        return None
+    if is_spans(raster):
+        return (int(raster[:, 1].min()), int(raster[:, 0].min()),
+                int(raster[:, 2].max()), int(raster[:, 0].max()) + 1)
+    x_min, y_min = raster.min(axis=0)
+    x_max, y_max = raster.max(axis=0)
+    return int(x_min), int(y_min), int(x_max) + 1, int(y_max) + 1
+
+
+def _intersects(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def merge_rects(rects):
+    """合并相交的矩形
+
+    :param rects: (list of tuple of int) 矩形列表，格式同bounding_box的返回值
+    :return: (list of tuple of int) 两两不相交的矩形列表
+    """
+    if len(rects) > MAX_DIRTY_RECTS:
+        x0, y0, x1, y1 = zip(*rects)
+        return [(min(x0), min(y0), max(x1), max(y1))]
+    rects = list(rects)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if _intersects(a, b):
+                    rects[i] = (min(a[0], b[0]), min(a[1], b[1]),
+                                max(a[2], b[2]), max(a[3], b[3]))
+                    rects.pop(j)
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+
+def write_bmp(path, pixels, on_band=None):
+    """把RGB数组保存为24位BMP，逐段转换写出，额外占用的内存不超过BMP_BAND_BYTES
+
+    文件头与Pillow保存的相同；文件超过4GB时文件大小和图像大小字段无法表示，写为0
+
+    :param path: (string) 输出文件路径
+    :param pixels: (numpy.ndarray of uint8, shape (height, width, 3)) 图像，可以放在内存映射中
+    :param on_band: (callable) 每写出一段后以该段的行范围(y0, y1)调用，为None时不调用
+    """
+    height, width = pixels.shape[:2]
+    stride = (width * 3 + 3) & ~3
+    image = stride * height
+    offset = 14 + 40
+    file_size = offset + image
+    if file_size > 0xffffffff:
+        file_size = image = 0
+    rows = max(1, BMP_BAND_BYTES // max(stride, 1))
+    with open(path, 'wb') as fp:
+        fp.write(struct.pack('<2sIII', b'BM', file_size, 0, offset))
+        fp.write(
+            struct.pack('<IiiHHIIiiII', 40, width, height, 1, 24, 0, image,
+                        BMP_PIXELS_PER_METER, BMP_PIXELS_PER_METER, 0, 0))
+        band = np.zeros([min(rows, height), stride], np.uint8)
+        bgr = band[:, :width * 3].reshape(len(band), width, 3)
+        # BMP从最下面一行开始存储，每个像素按BGR顺序排列，每行补齐到4字节；
+        # 逐个通道复制比整体反转最后一维快得多
+        for y1 in range(height, 0, -rows):
+            y0 = max(0, y1 - rows)
+            src = pixels[y0:y1][::-1]
+            for c in range(3):
+                bgr[:y1 - y0, :, c] = src[:, :, 2 - c]
+            fp.write(band[:y1 - y0])
+            if on_band is not None:
+                on_band(y0, y1)
+
+
+def write_raster(pixels, raster, color, rect=None):
+    """把光栅化结果写入图像
+
+    :param pixels: (numpy.ndarray of uint8, shape (height, width, 3)) 图像
+    :param raster: (numpy.ndarray of int) 不超出图像的像素点坐标或水平区间
+    :param color: (numpy.ndarray of uint8) 颜色
+    :param rect: (tuple of int) 只写入该矩形内的部分，为None时全部写入
+    """
+    if is_spans(raster):
+        if rect is not None:
+            raster = clip_spans(raster, *rect)
+        lengths = raster[:, 2] - raster[:, 1]
+        if len(raster) and lengths.mean() >= SPAN_SLICE_MIN_LENGTH:
+            # 从铺满颜色的一行中复制是连续内存拷贝，比把3个字节的颜色广播到整行快得多
+            line = np.tile(color, (int(lengths.max()), 1))
+            for y, x_start, x_end in raster.tolist():
+                pixels[y, x_start:x_end] = line[:x_end - x_start]
+            return
+        raster = cg_batch.to_points(raster)
+        rect = None
+    if rect is not None:
+        x0, y0, x1, y1 = rect
+        inside = ((raster[:, 0] >= x0) & (raster[:, 0] < x1) &
+                  (raster[:, 1] >= y0) & (raster[:, 1] < y1))
+        raster = raster[inside]
+    pixels[raster[:, 1], raster[:, 0]] = color
+
+
+def _unlink_shared(shm, path):
+    if shm is not None:
+        shm.unlink()
+    if path is not None:
+        os.unlink(path)
+
+
+class SharedArray:
+    """
+    可以在进程间共享的numpy数组
+
+    存放在multiprocessing.shared_memory中，或者指定目录时存放在该目录下文件的内存映射中。
+    创建者把descriptor传给子进程，子进程用SharedArray.attach映射同一块内存；
+    创建者被回收或调用unlink后共享内存或文件被删除
+    """
+    def __init__(self, shape, dtype, directory=None, descriptor=None):
+        """
+
+        :param shape: (tuple of int) 数组形状
+        :param dtype: (numpy.dtype) 元素类型
+        :param directory: (string) 文件所在的目录，为None时使用共享内存
+        :param descriptor: (tuple) 由attach传入，映射已有的共享数组而不是新建
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.shm = None
+        self.mmap = None
+        self.path = None
+        # 共享内存和mmap都不允许大小为0
+        size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+        kind = descriptor[0] if descriptor else (
+            'file' if directory is not None else 'shm')
+        if kind == 'shm':
+            if descriptor:
+                self.shm = shared_memory.SharedMemory(name=descriptor[1])
+            else:
+                self.shm = shared_memory.SharedMemory(create=True, size=size)
+            buffer = self.shm.buf
+        else:
+            if descriptor:
+                self.path = descriptor[1]
+                fd = os.open(self.path, os.O_RDWR)
+            else:
+                fd, self.path = tempfile.mkstemp(suffix='.framebuffer',
+                                                 dir=directory)
+                os.ftruncate(fd, size)
+            try:
+                self.mmap = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            if hasattr(mmap, 'MADV_RANDOM'):
+                # 页已在页缓存中时，缺页默认会顺带映射相邻的页，零散写入像素点时常驻内存成倍增长
+                self.mmap.madvise(mmap.MADV_RANDOM)
+            buffer = self.mmap
+        self.array = np.ndarray(self.shape, self.dtype, buffer=buffer)
+        self.descriptor = (kind, self.shm.name if self.shm else self.path,
+                           self.shape, self.dtype.str)
+        self._finalizer = None
+        if not descriptor:
+            self._finalizer = weakref.finalize(self, _unlink_shared, self.shm,
+                                               self.path)
+
+    @classmethod
+    def attach(cls, descriptor):
+        """映射其他进程创建的共享数组
+
+        :param descriptor: (tuple) 创建者的descriptor
+        :return: (SharedArray) 共享数组，用完后调用close
+        """
+        return cls(descriptor[2], descriptor[3], descriptor=descriptor)
+
+    def close(self):
+        """解除映射，之后不能再访问array"""
+        self.array = None
+        if self.shm is not None:
+            self.shm.close()
+        if self.mmap is not None:
+            self.mmap.close()
+
+    def unlink(self):
+        """删除共享内存或文件，已经映射的进程仍可继续访问"""
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+def render_tile_row(canvas, rasters, y_min, y_max, items):
+    """在子进程中绘制一行图块
+
+    先把[y_min, y_max)行涂成白色，再把图元裁剪到各个图块中，每个图块内按插入顺序绘制
+
+    :param canvas: (tuple) 帧缓冲的SharedArray.descriptor
+    :param rasters: (tuple) 所有图元光栅化结果首尾相接的SharedArray.descriptor
+    :param y_min: (int) 图块行的上边界
+    :param y_max: (int) 图块行的下边界（不含）
+    :param items: (numpy.ndarray of int64, shape (K, 10)) 与该行相交的图元，按插入顺序排列，
+                  每行为(偏移, 行数, 列数, x_min, y_min, x_max, y_max, r, g, b)
+    """
+    canvas = SharedArray.attach(canvas)
+    rasters = SharedArray.attach(rasters)
+    try:
+        _draw_tile_row(canvas.array, rasters.array, y_min, y_max, items)
+    finally:
+        canvas.close()
+        rasters.close()
+
+
+def _draw_tile_row(pixels, flat, y_min, y_max, items):
+    width = pixels.shape[1]
+    pixels[y_min:y_max] = 255
+    tiles = {}  # 图块列号 -> 按插入顺序排列的(光栅化结果, 颜色)
+    for offset, count, columns, x0, y0, x1, y1, r, g, b in items.tolist():
+        raster = flat[offset:offset + count * columns].reshape(
+            count, columns)
+        if y0 < y_min or y1 > y_max:
+            rows = raster[:, 0] if columns == 3 else raster[:, 1]
+            raster = raster[(rows >= y_min) & (rows < y_max)]
+            if len(raster) == 0:
+                continue
+            x0, _, x1, _ = bounding_box(raster)
+        color = np.array([r, g, b], np.uint8)
+        for col in range(x0 // TILE_SIZE, (x1 - 1) // TILE_SIZE + 1):
+            tiles.setdefault(col, []).append((raster, color))
+    for col in sorted(tiles):
+        rect = (col * TILE_SIZE, y_min, min((col + 1) * TILE_SIZE,
+                                            width), y_max)
+        for raster, color in tiles[col]:
+            write_raster(pixels, raster, color, rect)
+
+
+class Framebuffer:
+    """
+    跨多次saveCanvas保留的帧缓冲
+
+    记录自上次绘制以来被添加、变换或裁剪的图元，下次绘制时只重绘这些图元新旧包围矩形覆盖的区域，
+    区域内按插入顺序重绘所有与之相交的图元，结果与整幅重绘相同。
+
+    画布超过mmap_threshold字节时存放在临时文件的内存映射中。写入和保存都按行分段进行，
+    累计访问超过MMAP_RELEASE_BYTES后用madvise把页交还给操作系统（改动保留在文件中），
+    因此常驻内存不随画布大小增长。
+
+    有进程池且画布不小于TILED_MIN_PIXELS时，帧缓冲放在进程间共享的内存或文件中，
+    整幅重绘时画布按TILE_SIZE分块，图元按包围矩形分到各图块行，由子进程并行绘制，结果与逐个绘制相同
+    """
+    def __init__(self,
+                 width,
+                 height,
+                 mmap_threshold=None,
+                 mmap_dir=None,
+                 pool=None):
+        """
+
+        :param width: (int) 画布宽度
+        :param height: (int) 画布高度
+        :param mmap_threshold: (int) 画布超过该字节数时使用内存映射文件，为None时总是放在内存中
+        :param mmap_dir: (string) 内存映射文件所在的目录，为None时使用系统临时目录
+        :param pool: (concurrent.futures.ProcessPoolExecutor) 分块并行绘制使用的进程池
+        """
+        self.width = width
+        self.height = height
+        self.pool = pool
+        self.shared = None  # 与子进程共享的帧缓冲
+        self._mmap = None
+        self._touched = 0  # 上次释放以来访问过的字节数
+        size = width * height * 3
+        use_mmap = mmap_threshold is not None and size > mmap_threshold
+        if pool is not None and width * height >= TILED_MIN_PIXELS:
+            # 子进程按文件路径映射同一个文件，因此不能像下面那样创建后立即删除
+            directory = None
+            if use_mmap:
+                directory = mmap_dir or tempfile.gettempdir()
+            self.shared = SharedArray([height, width, 3], np.uint8,
+                                      directory)
+            self._mmap = self.shared.mmap
+            self.pixels = self.shared.array
+        elif use_mmap:
+            # 临时文件创建后即被删除，内存映射释放后磁盘空间随之回收
+            with tempfile.TemporaryFile(dir=mmap_dir) as fp:
+                fp.truncate(size)
+                self._mmap = mmap.mmap(fp.fileno(), size)
+            if hasattr(mmap, 'MADV_RANDOM'):
+                # 页已在页缓存中时，缺页默认会顺带映射相邻的页，零散写入像素点时常驻内存成倍增长
+                self._mmap.madvise(mmap.MADV_RANDOM)
+            self.pixels = np.ndarray([height, width, 3],
+                                     np.uint8,
+                                     buffer=self._mmap)
+        else:
+            self.pixels = np.zeros([height, width, 3], np.uint8)
+        if self.shared is None:
+            self._clear(0, 0, width, height)
+        self.boxes = {}  # 图元ID -> 上次绘制时的包围矩形
+        self.dirty = set()
+        self.full = True
+
+    def _touch(self, nbytes):
+        """记录访问了内存映射中约nbytes字节，累计超过MMAP_RELEASE_BYTES时释放"""
+        if self._mmap is None:
+            return
+        self._touched += nbytes
+        if self._touched >= MMAP_RELEASE_BYTES:
+            self.release()
+
+    def release(self):
+        """把内存映射中已换入的页交还给操作系统，被修改的页由操作系统写回文件后回收"""
+        if self._mmap is not None and hasattr(mmap, 'MADV_DONTNEED'):
+            self._mmap.madvise(mmap.MADV_DONTNEED)
+        self._touched = 0
+
+    def _clear(self, x_min, y_min, x_max, y_max):
+        """把矩形区域涂成白色，按行分段进行"""
+        row_bytes = max(1, (x_max - x_min) * 3)
+        rows = max(1, MMAP_RELEASE_BYTES // row_bytes)
+        for y0 in range(y_min, y_max, rows):
+            y1 = min(y0 + rows, y_max)
+            self.pixels[y0:y1, x_min:x_max] = 255
+            self._touch((y1 - y0) * self.width * 3)
+
+    def save(self, path):
+        """把帧缓冲保存为BMP
+
+        :param path: (string) 输出文件路径
+        """
+        sequential = self._mmap is not None and hasattr(
+            mmap, 'MADV_SEQUENTIAL')
+        if sequential:
+            # 保存时按行顺序读出，恢复预读
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        try:
+            write_bmp(path, self.pixels,
+                      lambda y0, y1: self._touch((y1 - y0) * self.width * 3))
+        finally:
+            if sequential:
+                self._mmap.madvise(mmap.MADV_RANDOM)
+
+    def mark_dirty(self, item_id):
+        """记录图元被添加、变换或裁剪
+
+        :param item_id: (string) 图元ID
+        """
+        self.dirty.add(item_id)
+
+    def take_dirty(self):
+        """取出目前记录的改动，之后的改动记入新的集合
+
+        在另一个线程中绘制时，用它在提交绘制的时刻给改动拍快照
+
+        :return: (set of string) 自上次取出或绘制以来有改动的图元ID
+        """
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def _wrap(self, raster):
+        """负坐标按numpy下标的规则映射到画布另一侧，与直接用canvas[y, x]写入的效果一致
+
+        水平区间与展开后的像素点效果相同：超出画布的水平区间展开为像素点后按同样的规则处理
+        """
+        if is_spans(raster):
+            if len(raster) == 0 or (raster[:, 0].min() >= 0
+                                    and raster[:, 1].min() >= 0
+                                    and raster[:, 0].max() < self.height
+                                    and raster[:, 2].max() <= self.width):
+                return raster
+            raster = cg_batch.to_points(raster)
+        if len(raster) and raster.min() < 0:
+            raster = raster + (raster < 0) * np.array(
+                [self.width, self.height], np.int32)
+        return raster
+
+    def _write(self, raster, color, rect=None):
+        """把光栅化结果写入帧缓冲
+
+        :param raster: (numpy.ndarray of int) 经过_wrap的像素点坐标或水平区间
+        :param color: (numpy.ndarray of uint8) 颜色
+        :param rect: (tuple of int) 只写入该矩形内的部分，为None时全部写入
+        """
+        write_raster(self.pixels, raster, color, rect)
+        if is_spans(raster):
+            self._touch(self._span_bytes(raster))
+        else:
+            self._touch(self._point_bytes(raster))
+
+    def _span_bytes(self, spans):
+        """写入水平区间最多换入的字节数"""
+        if self._mmap is None or len(spans) == 0:
+            return 0
+        rows = int(spans[:, 0].max() - spans[:, 0].min()) + 1
+        return min(rows * self.width * 3,
+                   len(spans) * mmap.PAGESIZE + pixel_count(spans) * 3)
+
+    def _point_bytes(self, pixels):
+        """写入像素点最多换入的字节数：每个像素可能落在不同的页中，但不超过覆盖的所有行"""
+        if self._mmap is None or len(pixels) == 0:
+            return 0
+        rows = int(pixels[:, 1].max() - pixels[:, 1].min()) + 1
+        return min(rows * self.width * 3, len(pixels) * mmap.PAGESIZE)
+
+    def render(self, item_dict, rasterize, dirty=None):
+        """把item_dict中的图元更新到帧缓冲
+
+        :param item_dict: (dict) 图元ID -> [item_type, p_list, algorithm, color]，按插入顺序即绘制顺序
+        :param rasterize: (callable) 接收图元列表，返回与之一一对应的像素点坐标数组或水平区间数组列表
+        :param dirty: (set of string) take_dirty取出的改动，为None时使用当前记录的改动
+        :return: (numpy.ndarray of uint8, shape (height, width, 3)) 帧缓冲
+        """
+        if dirty is None:
+            dirty = self.take_dirty()
+        try:
+            if self.full:
+                self._render_full(item_dict, rasterize)
+            elif dirty:
+                self._render_dirty(item_dict, rasterize, dirty)
+        except Exception:
+            # 有图元超出画布或光栅化出错时帧缓冲只更新了一部分，下次整幅重绘
+            self.full = True
+            raise
+        return self.pixels
+
+    def _render_full(self, item_dict, rasterize):
+        ids = list(item_dict)
+        rasters = [
+            self._wrap(pixels)
+            for pixels in rasterize([item_dict[i] for i in ids])
+        ]
+        boxes = [bounding_box(pixels) for pixels in rasters]
+        colors = [item_dict[i][3] for i in ids]
+        self.boxes = {}
+        # 有图元超出画布时按顺序绘制，抛出与逐个写入相同的IndexError
+        if self.shared is not None and all(
+                box is None or (box[2] <= self.width and box[3] <= self.height)
+                for box in boxes):
+            self._render_tiled(rasters, boxes, colors)
+        else:
+            self._clear(0, 0, self.width, self.height)
+            for pixels, color in zip(rasters, colors):
+                self._write(pixels, color)
+        self.boxes = dict(zip(ids, boxes))
+        self.full = False
+
+    def _render_tiled(self, rasters, boxes, colors):
+        """分块并行整幅重绘
+
+        :param rasters: (list of numpy.ndarray) 按插入顺序排列、经过_wrap的光栅化结果
+        :param boxes: (list of tuple) 各光栅化结果的包围矩形
+        :param colors: (list of numpy.ndarray) 各图元的颜色
+        """
+        keep = [k for k, box in enumerate(boxes) if box is not None]
+        items = np.zeros([len(keep), 10], np.int64)
+        sizes = np.array([rasters[k].size for k in keep], np.int64)
+        if keep:
+            items[:, 0] = np.cumsum(sizes) - sizes
+            items[:, 1] = [len(rasters[k]) for k in keep]
+            items[:, 2] = [rasters[k].shape[1] for k in keep]
+            items[:, 3:7] = [boxes[k] for k in keep]
+            items[:, 7:10] = [colors[k] for k in keep]
+        # 光栅化结果首尾相接放进共享内存，子进程各自取出与自己的图块行相交的部分
+        flat = SharedArray([int(sizes.sum())], np.int32)
+        try:
+            for k, offset, size in zip(keep, items[:, 0], sizes):
+                flat.array[offset:offset + size] = rasters[k].ravel()
+            # 每个图元分到它的包围矩形覆盖的所有图块行，同一行内保持插入顺序
+            first = items[:, 4] // TILE_SIZE
+            spans = (items[:, 6] - 1) // TILE_SIZE - first + 1
+            owner = np.repeat(np.arange(len(items)), spans)
+            row = np.repeat(first, spans) + (np.arange(int(spans.sum())) -
+                                             np.repeat(
+                                                 np.cumsum(spans) - spans,
+                                                 spans))
+            order = np.argsort(row, kind='stable')
+            rows = (self.height + TILE_SIZE - 1) // TILE_SIZE
+            bounds = np.searchsorted(row[order], np.arange(rows + 1))
+            futures = [
+                self.pool.submit(render_tile_row, self.shared.descriptor,
+                                 flat.descriptor, r * TILE_SIZE,
+                                 min((r + 1) * TILE_SIZE, self.height),
+                                 items[owner[order[bounds[r]:bounds[r + 1]]]])
+                for r in range(rows)
+            ]
+            for future in futures:
+                future.result()
+        finally:
+            flat.close()
+            flat.unlink()
+
+    def _render_dirty(self, item_dict, rasterize, dirty):
+        rects = []
+        for item_id in dirty:
+            if self.boxes.get(item_id) is not None:
+                rects.append(self.boxes.pop(item_id))
+        ids = [i for i in item_dict if i in dirty]
+        drawn = {}
+        for item_id, pixels in zip(ids,
+                                   rasterize([item_dict[i] for i in ids])):
+            drawn[item_id] = self._wrap(pixels)
+            self.boxes[item_id] = bounding_box(drawn[item_id])
+            if self.boxes[item_id] is not None:
+                rects.append(self.boxes[item_id])
+        rects = merge_rects(rects)
+        area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in rects)
+        if area > FULL_REDRAW_RATIO * self.width * self.height:
+            self._render_full(item_dict, rasterize)
+            return
+
+        # 与脏区域相交的未修改图元从缓存中取出像素，一起按插入顺序重绘
+        ids = [i for i in item_dict if self.boxes.get(i) is not None]
+        boxes = np.array([self.boxes[i] for i in ids]).reshape(-1, 1, 4)
+        r = np.array(rects).reshape(1, -1, 4)
+        hits = ((boxes[..., 0] < r[..., 2]) & (r[..., 0] < boxes[..., 2]) &
+                (boxes[..., 1] < r[..., 3]) & (r[..., 1] < boxes[..., 3]))
+        hit_rows = np.flatnonzero(hits.any(axis=1))
+        clean = [ids[k] for k in hit_rows if ids[k] not in drawn]
+        for item_id, pixels in zip(clean,
+                                   rasterize([item_dict[i] for i in clean])):
+            drawn[item_id] = self._wrap(pixels)
+        for x0, y0, x1, y1 in rects:
+            self._clear(x0, y0, x1, y1)
+        for k in hit_rows:
+            item_id = ids[k]
+            for rect in r[0, hits[k]]:
+                self._write(drawn[item_id], item_dict[item_id][3], rect)
@@ -3,137 +3,746 @@
 
 import sys
 import os
-import cg_algorithms as alg
+import time
+import argparse
+from collections import namedtuple, deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import resource_tracker
+import cg_batch
+from cg_cache import raster_cache
+from cg_canvas import Framebuffer, pixel_count
+from cg_profile import Profiler
 import numpy as np
-from PIL import Image
 
-if __name__ == '__main__':
-    input_file = sys.argv[1]
-    output_dir = sys.argv[2]
-    os.makedirs(output_dir, exist_ok=True)
+# 待光栅化的图元少于该数目时不使用进程池
+PARALLEL_MIN_ITEMS = 64
+# 使用进程池时每个任务包含的图元个数
+PARALLEL_CHUNK_SIZE = 256
+# 默认在画布超过该大小（MB）时使用内存映射文件作为帧缓冲
+DEFAULT_MMAP_THRESHOLD_MB = 1024
+# 默认最多有这么多帧的saveCanvas在后台排队
+DEFAULT_SAVE_QUEUE = 4
+
+
+def draw_line_items(items):
+    """把所有线段和多边形图元的边按算法分组，批量光栅化
+
+    :param items: (list) 图元列表，每个图元的前三项为item_type, p_list, algorithm
+    :return: (dict) 图元在items中的下标 -> 该图元的像素点坐标数组
+    """
+    groups = {}
+    for i, item in enumerate(items):
+        item_type, p_list, algorithm = item[:3]
+        if item_type == 'line':
+            edges = np.asarray(p_list, np.int64).reshape(-1, 2, 2)
+        elif item_type == 'polygon':
+            edges = cg_batch.polygon_edges(p_list)
+        else:
+            continue
+        owners, segments = groups.setdefault(algorithm, ([], []))
+        owners.append((i, len(edges)))
+        segments.append(edges)
+
+    result = {}
+    for algorithm, (owners, segments) in groups.items():
+        pixels, counts = cg_batch.draw_lines(np.concatenate(segments),
+                                             algorithm,
+                                             return_counts=True)
+        # 每个图元的边在segments中是连续的，按边数把像素个数累加回图元
+        edge_owner = np.repeat(np.arange(len(owners)),
+                               [n for _, n in owners])
+        item_counts = np.bincount(edge_owner,
+                                  weights=counts,
+                                  minlength=len(owners)).astype(np.int64)
+        for (i, _), item_pixels in zip(
+                owners, np.split(pixels, np.cumsum(item_counts)[:-1])):
+            result[i] = item_pixels
+    return result
+
+
+def rasterize_items(items, tolerance=None, unique=False, return_counts=False):
+    """光栅化一组图元，线段和多边形批量绘制，不使用缓存
+
+    每个图元的结果取像素点坐标和水平区间中占用内存较小的一种，见cg_batch.compact
+
+    :param items: (list) 图元列表，每个图元的前三项为item_type, p_list, algorithm
+    :param tolerance: (float) Bezier曲线自适应细分的平直度容差，为None时固定采样
+    :param unique: (bool) 为True时像素点坐标去除重复点
+    :param return_counts: (bool) 为True时额外返回每个图元的算法输出的像素个数（含重复点）
+    :return: (list of numpy.ndarray) 与items一一对应的像素点坐标数组或水平区间数组；
+             return_counts为True时返回(光栅化结果, 每个图元去重前的像素个数)
+    """
+    line_pixels = draw_line_items(items)
+    result = []
+    counts = np.zeros(len(items), np.int64)
+    for i, item in enumerate(items):
+        if i in line_pixels:
+            pixels = line_pixels[i]
+        else:
+            item_type, p_list, algorithm = item[:3]
+            pixels = cg_batch.draw_item(item_type,
+                                        p_list,
+                                        algorithm,
+                                        tolerance=tolerance)
+        counts[i] = pixel_count(pixels)
+        result.append(cg_batch.compact(pixels, unique))
+    if return_counts:
+        return result, counts
+    return result
+
+
+def rasterize_chunk(items, tolerance=None, unique=False):
+    """在子进程中光栅化一组图元
+
+    结果展平后拼接成一个数组返回，避免为每个图元单独序列化一个小数组。
+    像素点坐标每行2列，填充多边形的水平区间每行3列，所以同时返回每个图元的列数
+
+    :param items: (list) 图元列表，每个图元为(item_type, p_list, algorithm)
+    :param tolerance: (float) Bezier曲线自适应细分的平直度容差
+    :param unique: (bool) 为True时像素点坐标去除重复点
+    :return: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray) 所有图元首尾相接的一维坐标，
+             每个图元的行数，每个图元的列数，每个图元去重前的像素个数
+    """
+    pixels, emitted = rasterize_items(items, tolerance, unique, True)
+    counts = np.array([len(p) for p in pixels], np.int64)
+    widths = np.array([p.shape[1] for p in pixels], np.int64)
+    if not pixels:
+        return np.empty(0, np.int32), counts, widths, emitted
+    return np.concatenate([p.ravel() for p in pixels]), counts, widths, emitted
+
+
+def rasterize_parallel(items,
+                       pool,
+                       tolerance=None,
+                       unique=False,
+                       return_counts=False):
+    """用进程池光栅化一组图元
+
+    :param items: (list) 图元列表，每个图元的前三项为item_type, p_list, algorithm
+    :param pool: (concurrent.futures.ProcessPoolExecutor) 进程池
+    :param tolerance: (float) Bezier曲线自适应细分的平直度容差
+    :param unique: (bool) 为True时像素点坐标去除重复点
+    :param return_counts: (bool) 为True时额外返回每个图元去重前的像素个数
+    :return: (list of numpy.ndarray) 与items一一对应的像素点坐标数组或水平区间数组；
+             return_counts为True时返回(光栅化结果, 每个图元去重前的像素个数)
+    """
+    # 按插入顺序切块分给各进程，块内的线段和多边形仍然批量绘制
+    chunks = [[item[:3] for item in items[i:i + PARALLEL_CHUNK_SIZE]]
+              for i in range(0, len(items), PARALLEL_CHUNK_SIZE)]
+    result = []
+    emitted = [np.empty(0, np.int64)]
+    for pixels, counts, widths, chunk_emitted in pool.map(
+            rasterize_chunk, chunks, [tolerance] * len(chunks),
+        [unique] * len(chunks)):
+        parts = np.split(pixels, np.cumsum(counts * widths)[:-1])
+        result.extend(
+            p.reshape(-1, w) for p, w in zip(parts, widths.tolist()))
+        emitted.append(chunk_emitted)
+    if return_counts:
+        return result, np.concatenate(emitted)
+    return result
+
+
+def draw_items(items, tolerance=None, pool=None, unique=False, stats=None):
+    """光栅化所有图元，先查缓存，未命中的图元再批量绘制
+
+    :param items: (list) item_dict中的图元，每个图元为[item_type, p_list, algorithm, color]
+    :param tolerance: (float) Bezier曲线自适应细分的平直度容差，为None时固定采样
+    :param pool: (concurrent.futures.ProcessPoolExecutor) 进程池，为None时在当前进程中绘制
+    :param unique: (bool) 为True时像素点坐标去除重复点，每个像素只写入一次
+    :param stats: (dict) 不为None时把本次新光栅化的图元由算法输出的像素个数和实际写入的像素个数累加到
+                  stats['emitted']和stats['written']，命中缓存的图元不计入
+    :return: (list of numpy.ndarray) 与items一一对应的像素点坐标数组或水平区间数组
+    """
+    keys = [
+        raster_cache.key(item_type,
+                         p_list,
+                         algorithm,
+                         tolerance=tolerance,
+                         unique=unique)
+        for item_type, p_list, algorithm, color in items
+    ]
+    result = [raster_cache.get(key) for key in keys]
+    # 几何参数相同的图元只绘制一次
+    missing = {}
+    for i, key in enumerate(keys):
+        if result[i] is None:
+            missing.setdefault(key, i)
+    todo = [items[i] for i in missing.values()]
+    if pool is not None and len(todo) >= PARALLEL_MIN_ITEMS:
+        drawn, emitted = rasterize_parallel(todo, pool, tolerance, unique,
+                                            True)
+    else:
+        drawn, emitted = rasterize_items(todo, tolerance, unique, True)
+    if stats is not None:
+        stats['emitted'] = stats.get('emitted', 0) + int(emitted.sum())
+        stats['written'] = stats.get('written', 0) + sum(
+            pixel_count(p) for p in drawn)
+    drawn = dict(zip(missing, drawn))
+    for key, pixels in drawn.items():
+        raster_cache.put(key, pixels)
+    for i, key in enumerate(keys):
+        if result[i] is None:
+            result[i] = drawn[key]
+    return result
+
+
+# 指令记录，每种指令一个类型
+ResetCanvas = namedtuple('ResetCanvas', 'width height')
+SaveCanvas = namedtuple('SaveCanvas', 'name')
+SetColor = namedtuple('SetColor', 'r g b')
+DrawLine = namedtuple('DrawLine', 'item_id x0 y0 x1 y1 algorithm')
+DrawPolygon = namedtuple('DrawPolygon', 'item_id points algorithm')
+DrawEllipse = namedtuple('DrawEllipse', 'item_id x0 y0 x1 y1')
+DrawCurve = namedtuple('DrawCurve', 'item_id points algorithm')
+FillPolygon = namedtuple('FillPolygon', 'item_id points algorithm')
+Translate = namedtuple('Translate', 'item_id dx dy')
+Rotate = namedtuple('Rotate', 'item_id x y r')
+Scale = namedtuple('Scale', 'item_id x y s')
+Clip = namedtuple('Clip', 'item_id x0 y0 x1 y1 algorithm')
+Group = namedtuple('Group', 'group_id item_ids')
+# 无法解析的行
+Malformed = namedtuple('Malformed', 'text reason')
+
+
+def _fixed_args(record, *types):
+    """生成定长参数指令的解析函数
+
+    :param record: (type) 指令记录类型
+    :param types: (callable) 各参数的类型转换函数
+    :return: (callable) 解析函数，接收参数字符串列表，返回指令记录
+    """
+    def parse(args):
+        if len(args) != len(types):
+            raise ValueError('需要%d个参数，实际为%d个' % (len(types), len(args)))
+        return record(*[t(a) for t, a in zip(types, args)])
+
+    return parse
+
+
+def _point_args(record, min_points):
+    """生成'id x0 y0 x1 y1 ... algorithm'格式指令的解析函数
+
+    坐标不足的图元在之后每次saveCanvas时才会出错，因此在解析时就检查点数
+
+    :param record: (type) 指令记录类型
+    :param min_points: (int) 至少需要的点数
+    :return: (callable) 解析函数，接收参数字符串列表，返回指令记录
+    """
+    def parse(args):
+        if len(args) < 2 or len(args) % 2 != 0:
+            raise ValueError('需要图元编号、成对的坐标和算法')
+        if (len(args) - 2) // 2 < min_points:
+            raise ValueError('需要至少%d个点，实际为%d个' %
+                             (min_points, (len(args) - 2) // 2))
+        coords = [int(a) for a in args[1:-1]]
+        points = [[coords[i], coords[i + 1]] for i in range(0, len(coords), 2)]
+        return record(args[0], points, args[-1])
+
+    return parse
+
+
+def _group_args(args):
+    """解析'group 组名 id1 id2 ...'指令"""
+    if len(args) < 2:
+        raise ValueError('需要组名和至少一个图元编号')
+    return Group(args[0], args[1:])
+
+
+# 指令名 -> 参数解析函数
+COMMAND_PARSERS = {
+    'resetCanvas': _fixed_args(ResetCanvas, int, int),
+    'saveCanvas': _fixed_args(SaveCanvas, str),
+    'setColor': _fixed_args(SetColor, int, int, int),
+    'drawLine': _fixed_args(DrawLine, str, int, int, int, int, str),
+    'drawPolygon': _point_args(DrawPolygon, 2),
+    'drawEllipse': _fixed_args(DrawEllipse, str, int, int, int, int),
+    'drawCurve': _point_args(DrawCurve, 1),
+    'fillPolygon': _point_args(FillPolygon, 2),
+    'translate': _fixed_args(Translate, str, int, int),
+    'rotate': _fixed_args(Rotate, str, int, int, float),
+    'scale': _fixed_args(Scale, str, int, int, float),
+    'clip': _fixed_args(Clip, str, int, int, int, int, str),
+    'group': _group_args,
+}
+
+
+def parse_commands(lines):
+    """逐行解析指令，不会把整个文件读入内存
+
+    空行和以#开头的行被忽略，无法解析的行产生Malformed记录而不是抛出异常
+
+    :param lines: (iterable of str) 指令文本行，例如打开的文件对象
+    :return: (generator) 逐条产生(行号, 指令记录)
+    """
+    for lineno, line in enumerate(lines, 1):
+        tokens = line.split()
+        if not tokens or tokens[0].startswith('#'):
+            continue
+        parse = COMMAND_PARSERS.get(tokens[0])
+        if parse is None:
+            yield lineno, Malformed(line.strip(), '未知指令%s' % tokens[0])
+            continue
+        try:
+            yield lineno, parse(tokens[1:])
+        except ValueError as e:
+            yield lineno, Malformed(line.strip(), str(e))
+
+
+class FrameWriter:
+    """
+    在后台线程中依次绘制并保存saveCanvas提交的帧
+
+    帧缓冲在相邻两次saveCanvas之间增量更新，各帧只能按顺序绘制，因此只用一个线程；
+    numpy运算和写文件时会释放GIL，主线程可以同时解析和执行后续指令。
+    未完成的帧达到max_pending时submit阻塞，直到最早的一帧完成
+    """
+    def __init__(self, max_pending):
+        """
+
+        :param max_pending: (int) 排队和正在绘制的帧数上限
+        """
+        self.max_pending = max_pending
+        self.failed = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = deque()  # (future, 文件名, 行号)
+
+    def submit(self, source, lineno, fn, *args):
+        """提交一帧，已完成的帧随即检查结果
+
+        :param source: (string) 报错时显示的文件名
+        :param lineno: (int) saveCanvas指令的行号
+        :param fn: (callable) 绘制并保存一帧的函数
+        """
+        while self._pending and (len(self._pending) >= self.max_pending
+                                 or self._pending[0][0].done()):
+            self._collect()
+        self._pending.append((self._executor.submit(fn, *args), source,
+                              lineno))
+
+    def _collect(self):
+        future, source, lineno = self._pending.popleft()
+        try:
+            future.result()
+        except Exception as e:
+            # 后台线程中的任何错误都报告在提交这一帧的saveCanvas上，不留到之后的submit中抛出
+            self.failed += 1
+            print('%s:%d: SaveCanvas执行失败: %s: %s' %
+                  (source, lineno, type(e).__name__, e),
+                  file=sys.stderr)
 
-    item_dict = {}
-    pen_color = np.zeros(3, np.uint8)
-    width = 0
-    height = 0
+    def flush(self):
+        """等待所有已提交的帧写完，失败的帧报告后计入failed"""
+        while self._pending:
+            self._collect()
 
+    def wait(self):
+        """等待所有已提交的帧写完
+
+        :return: (int) 上次wait以来保存失败的帧数
+        """
+        self.flush()
+        failed, self.failed = self.failed, 0
+        return failed
+
+    def shutdown(self):
+        self.flush()
+        self._executor.shutdown()
+
+
+class CommandRunner:
+    """
+    指令执行器，保存画布状态，按指令记录的类型分派给对应的处理函数
+    """
+    def __init__(self,
+                 output_dir,
+                 tolerance=None,
+                 pool=None,
+                 profiler=None,
+                 mmap_threshold=None,
+                 mmap_dir=None,
+                 writer=None,
+                 unique=False):
+        """
+
+        :param output_dir: (string) 图像保存目录
+        :param tolerance: (float) Bezier曲线自适应细分的平直度容差，为None时固定采样
+        :param pool: (concurrent.futures.ProcessPoolExecutor) saveCanvas时使用的进程池
+        :param profiler: (cg_profile.Profiler) 记录各指令和各阶段的耗时，为None时不记录
+        :param mmap_threshold: (int) 画布超过该字节数时帧缓冲使用内存映射文件，为None时总是放在内存中
+        :param mmap_dir: (string) 内存映射文件所在的目录，为None时使用系统临时目录
+        :param writer: (FrameWriter) 在后台绘制和保存saveCanvas的帧，为None时在saveCanvas中同步完成
+        :param unique: (bool) 光栅化结果去除重复点，每个像素只写入一次
+        """
+        self.output_dir = output_dir
+        self.tolerance = tolerance
+        self.pool = pool
+        self.profiler = profiler
+        self.mmap_threshold = mmap_threshold
+        self.mmap_dir = mmap_dir
+        self.writer = writer
+        self.unique = unique
+        # 光栅化输出的像素个数和写入的像素个数，见draw_items
+        self.pixel_stats = {'emitted': 0, 'written': 0}
+        self.source = ''
+        self.lineno = 0  # 正在执行的指令的行号，提交后台保存时记下
+        self.item_dict = {}
+        # 图元ID -> 尚未作用到p_list上的累积仿射矩阵
+        self.transforms = {}
+        # 组名 -> 组内图元ID列表，平移、旋转、缩放指令可以用组名代替图元ID
+        self.groups = {}
+        self.pen_color = np.zeros(3, np.uint8)
+        self.width = 0
+        self.height = 0
+        self.framebuffer = Framebuffer(self.width, self.height)
+        self.handlers = {
+            ResetCanvas: self.reset_canvas,
+            SaveCanvas: self.save_canvas,
+            SetColor: self.set_color,
+            DrawLine: self.draw_line,
+            DrawPolygon: self.draw_polygon,
+            DrawEllipse: self.draw_ellipse,
+            DrawCurve: self.draw_curve,
+            FillPolygon: self.fill_polygon,
+            Translate: self.translate,
+            Rotate: self.rotate,
+            Scale: self.scale,
+            Clip: self.clip,
+            Group: self.group,
+        }
+
+    def run(self, commands, source=''):
+        """执行指令，出错的指令报告行号后跳过，不中止后续指令
+
+        :param commands: (iterable) parse_commands产生的(行号, 指令记录)
+        :param source: (string) 报错时显示的文件名
+        :return: (int) 出错的指令条数
+        """
+        errors = 0
+        self.source = source
+        for lineno, command in commands:
+            self.lineno = lineno
+            if isinstance(command, Malformed):
+                reason = '无法解析 "%s": %s' % (command.text, command.reason)
+            else:
+                try:
+                    if self.profiler is None:
+                        self.handlers[type(command)](command)
+                    else:
+                        with self.span(type(command).__name__,
+                                       'command',
+                                       line=lineno,
+                                       item=getattr(command, 'item_id', '')):
+                            self.handlers[type(command)](command)
+                    continue
+                except Exception as e:
+                    reason = '%s执行失败: %s: %s' % (type(command).__name__,
+                                                  type(e).__name__, e)
+            errors += 1
+            print('%s:%d: %s' % (source, lineno, reason), file=sys.stderr)
+        if self.writer is not None:
+            errors += self.writer.wait()
+        return errors
+
+    def span(self, name, cat, **args):
+        """开启--profile时对一段代码计时，否则什么也不做
+
+        :param name: (string) 区间名称
+        :param cat: (string) 区间类别，'command'、'phase'、'item'
+        :return: (context manager) 产生区间附加信息的dict
+        """
+        if self.profiler is None:
+            return nullcontext(args)
+        return self.profiler.span(name, cat, **args)
+
+    def rasterize(self, items):
+        """光栅化需要重绘的图元
+
+        开启--profile时逐个图元绘制，记录每个图元的耗时和像素数；此时不使用进程池，
+        线段和多边形也不再批量绘制，总耗时会比正常运行略长
+
+        :param items: (list) item_dict中的图元
+        :return: (list of numpy.ndarray) 与items一一对应的像素点坐标数组或水平区间数组
+        """
+        if self.profiler is None:
+            return draw_items(items, self.tolerance, self.pool, self.unique,
+                              self.pixel_stats)
+        names = {id(item): item_id for item_id, item in self.item_dict.items()}
+        result = []
+        with self.span('rasterize', 'phase', items=len(items)) as args:
+            for item in items:
+                hits = raster_cache.hits
+                with self.span(names.get(id(item), ''),
+                               'item',
+                               type=item[0],
+                               algorithm=item[2]) as item_args:
+                    pixels = draw_items([item], self.tolerance, None,
+                                        self.unique, self.pixel_stats)[0]
+                    item_args['pixels'] = pixel_count(pixels)
+                    item_args['cached'] = raster_cache.hits > hits
+                result.append(pixels)
+            args['pixels'] = sum(pixel_count(p) for p in result)
+        return result
+
+    def add_item(self, item_id, item_type, p_list, algorithm=''):
+        if item_id in self.groups:
+            raise ValueError('图元编号%s与组名重复' % item_id)
+        self.transforms.pop(item_id, None)
+        self.item_dict[item_id] = [
+            item_type, p_list, algorithm,
+            np.array(self.pen_color)
+        ]
+        self.framebuffer.mark_dirty(item_id)
+
+    def set_p_list(self, item_id, p_list):
+        self.item_dict[item_id][1] = p_list
+        self.framebuffer.mark_dirty(item_id)
+
+    def add_transform(self, item_id, matrix):
+        """把变换累积到图元的变换矩阵上，不立即修改p_list
+
+        组内各图元的顶点在saveCanvas时由apply_transforms叠放在一个数组中一起变换
+
+        :param item_id: (string) 图元ID或组名
+        :param matrix: (tuple of float) 本次变换的仿射矩阵，格式见cg_batch.translate_matrix
+        """
+        item_ids = self.groups.get(item_id, [item_id])
+        for i in item_ids:
+            if i not in self.item_dict:
+                raise KeyError(i)
+        for i in item_ids:
+            old = self.transforms.get(i)
+            self.transforms[i] = (matrix if old is None else
+                                  cg_batch.compose(matrix, old))
+
+    def apply_transforms(self, item_ids=None):
+        """把累积的变换一次性作用到图元的p_list上
+
+        :param item_ids: (list of string) 需要更新的图元ID，为None时更新所有图元
+        """
+        if item_ids is None:
+            item_ids = list(self.transforms)
+        item_ids = [i for i in item_ids if i in self.transforms]
+        if not item_ids:
+            return
+        p_lists = cg_batch.apply_transforms(
+            [self.item_dict[i][1] for i in item_ids],
+            [self.transforms.pop(i) for i in item_ids])
+        for item_id, p_list in zip(item_ids, p_lists):
+            self.set_p_list(item_id, p_list)
+
+    def reset_canvas(self, command):
+        self.width = command.width
+        self.height = command.height
+        self.item_dict.clear()
+        self.transforms.clear()
+        self.groups.clear()
+        # 先释放旧的帧缓冲，避免两块大画布同时存在；后台还在使用它时等待写完
+        if self.writer is not None:
+            self.writer.flush()
+        self.framebuffer = None
+        self.framebuffer = Framebuffer(self.width, self.height,
+                                       self.mmap_threshold, self.mmap_dir,
+                                       self.pool)
+
+    def save_canvas(self, command):
+        with self.span('transform', 'phase', items=len(self.transforms)):
+            self.apply_transforms()
+        path = os.path.join(self.output_dir, command.name + '.bmp')
+        if self.writer is not None:
+            # 各指令只会替换图元的p_list而不会原地修改，浅拷贝每个图元即可得到当前状态的快照
+            item_dict = {
+                item_id: list(item)
+                for item_id, item in self.item_dict.items()
+            }
+            self.writer.submit(self.source, self.lineno, self.write_frame,
+                               self.framebuffer, item_dict,
+                               self.framebuffer.take_dirty(), path)
+            return
+        # 帧缓冲在多次saveCanvas之间保留，只重绘有改动的区域
+        with self.span('framebuffer', 'phase', dirty=len(self.framebuffer.dirty)):
+            self.framebuffer.render(self.item_dict, self.rasterize)
+        with self.span('encode', 'phase', file=command.name + '.bmp'):
+            self.framebuffer.save(path)
+
+    def write_frame(self, framebuffer, item_dict, dirty, path):
+        """在FrameWriter的线程中绘制并保存一帧
+
+        :param framebuffer: (cg_canvas.Framebuffer) 提交时的帧缓冲
+        :param item_dict: (dict) 提交时item_dict的快照
+        :param dirty: (set of string) 提交时取出的改动
+        :param path: (string) 图像保存路径
+        """
+        framebuffer.render(item_dict, self.rasterize, dirty)
+        framebuffer.save(path)
+
+    def set_color(self, command):
+        self.pen_color[:] = command.r, command.g, command.b
+
+    def draw_line(self, command):
+        self.add_item(command.item_id, 'line',
+                      [[command.x0, command.y0], [command.x1, command.y1]],
+                      command.algorithm)
+
+    def draw_polygon(self, command):
+        self.add_item(command.item_id, 'polygon', command.points,
+                      command.algorithm)
+
+    def draw_ellipse(self, command):
+        self.add_item(command.item_id, 'ellipse',
+                      [[command.x0, command.y0], [command.x1, command.y1]])
+
+    def draw_curve(self, command):
+        self.add_item(command.item_id, 'curve', command.points,
+                      command.algorithm)
+
+    def fill_polygon(self, command):
+        # 填充规则写在算法的位置上
+        if command.algorithm not in ('even-odd', 'nonzero'):
+            raise ValueError('未知的填充规则%s' % command.algorithm)
+        self.add_item(command.item_id, 'fill', command.points,
+                      command.algorithm)
+
+    def translate(self, command):
+        self.add_transform(command.item_id,
+                           cg_batch.translate_matrix(command.dx, command.dy))
+
+    def rotate(self, command):
+        self.add_transform(
+            command.item_id,
+            cg_batch.rotate_matrix(command.x, command.y, command.r))
+
+    def scale(self, command):
+        self.add_transform(
+            command.item_id,
+            cg_batch.scale_matrix(command.x, command.y, command.s))
+
+    def clip(self, command):
+        x_min = min(command.x0, command.x1)
+        x_max = max(command.x0, command.x1)
+        y_min = min(command.y0, command.y1)
+        y_max = max(command.y0, command.y1)
+        self.apply_transforms([command.item_id])
+        p_list = self.item_dict[command.item_id][1]
+        if not p_list:
+            return
+        clipped, keep = cg_batch.clip_many([[p_list[0], p_list[-1]]],
+                                           (x_min, y_min, x_max, y_max),
+                                           command.algorithm)
+        # 完全在窗口外的线段保留图元ID但不再绘制
+        self.set_p_list(command.item_id, clipped[0].tolist() if keep[0] else [])
+
+    def group(self, command):
+        if command.group_id in self.item_dict:
+            raise ValueError('组名%s与图元编号重复' % command.group_id)
+        for item_id in command.item_ids:
+            if item_id not in self.item_dict:
+                raise KeyError(item_id)
+        self.groups[command.group_id] = list(command.item_ids)
+
+
+def measure_throughput(input_file):
+    """只解析不执行，统计每秒解析的指令条数
+
+    :param input_file: (string) 指令文件的路径
+    """
+    count = 0
+    malformed = 0
+    start = time.perf_counter()
     with open(input_file, 'r') as fp:
-        line = fp.readline()
-        while line:
-            line = line.strip().split(' ')
-            if line[0] == 'resetCanvas':
-                width = int(line[1])
-                height = int(line[2])
-                item_dict.clear()
-            elif line[0] == 'saveCanvas':
-                save_name = line[1]
-                canvas = np.zeros([height, width, 3], np.uint8)
-                canvas.fill(255)
-                for item_type, p_list, algorithm, color in item_dict.values():
-                    if item_type == 'line':
-                        pixels = alg.draw_line(p_list, algorithm)
-                        for x, y in pixels:
-                            canvas[y, x] = color
-                    elif item_type == 'polygon':
-                        pixels = alg.draw_polygon(p_list, algorithm)
-                        for x, y in pixels:
-                            canvas[y, x] = color
-                    elif item_type == 'ellipse':
-                        pixels = alg.draw_ellipse(p_list)
-                        for x, y in pixels:
-                            canvas[y, x] = color
-                    elif item_type == 'curve':
-                        pixels = alg.draw_curve(p_list, algorithm)
-                        for x, y in pixels:
-                            canvas[y, x] = color
-
-                Image.fromarray(canvas).save(
-                    os.path.join(output_dir, save_name + '.bmp'), 'bmp')
-            elif line[0] == 'setColor':
-                pen_color[0] = int(line[1])
-                pen_color[1] = int(line[2])
-                pen_color[2] = int(line[3])
-            elif line[0] == 'drawLine':
-                item_id = line[1]
-                x0 = int(line[2])
-                y0 = int(line[3])
-                x1 = int(line[4])
-                y1 = int(line[5])
-                algorithm = line[6]
-                item_dict[item_id] = [
-                    'line', [[x0, y0], [x1, y1]], algorithm,
-                    np.array(pen_color)
-                ]
-            elif line[0] == 'drawPolygon':
-                item_id = line[1]
-                i = 2
-                points = []
-                while i <= len(line) - 3:
-                    points.append([int(line[i]), int(line[i + 1])])
-                    i += 2
-                algorithm = line[-1]
-                item_dict[item_id] = [
-                    'polygon', points, algorithm,
-                    np.array(pen_color)
-                ]
-            elif line[0] == 'drawEllipse':
-                item_id = line[1]
-                x0 = int(line[2])
-                y0 = int(line[3])
-                x1 = int(line[4])
-                y1 = int(line[5])
-                item_dict[item_id] = [
-                    'ellipse', [[x0, y0], [x1, y1]], algorithm,
-                    np.array(pen_color)
-                ]
-            elif line[0] == 'drawCurve':
-                item_id = line[1]
-                i = 2
-                points = []
-                while i <= len(line) - 3:
-                    points.append([int(line[i]), int(line[i + 1])])
-                    i += 2
-                algorithm = line[-1]
-                item_dict[item_id] = [
-                    'curve', points, algorithm,
-                    np.array(pen_color)
-                ]
-            elif line[0] == 'translate':
-                item_id = line[1]
-                dx = int(line[2])
-                dy = int(line[3])
-                item_dict[item_id][1] = alg.translate(item_dict[item_id][1],
-                                                      dx, dy)
-
-            elif line[0] == 'rotate':
-                item_id = line[1]
-                x = int(line[2])
-                y = int(line[3])
-                r = float(line[4])
-                item_dict[item_id][1] = alg.rotate(item_dict[item_id][1], x, y,
-                                                   r)
-
-            elif line[0] == 'scale':
-                item_id = line[1]
-                x = int(line[2])
-                y = int(line[3])
-                s = float(line[4])
-                item_dict[item_id][1] = alg.scale(item_dict[item_id][1], x, y,
-                                                  s)
-
-            elif line[0] == 'clip':
-                item_id = line[1]
-                x0 = int(line[2])
-                y0 = int(line[3])
-                x1 = int(line[4])
-                y1 = int(line[5])
-                x_min = min(x0, x1)
-                x_max = max(x0, x1)
-                y_min = min(y0, y1)
-                y_max = max(y0, y1)
-                algorithm = line[6]
-                p_list = [item_dict[item_id][1][0], item_dict[item_id][1][-1]]
-                item_dict[item_id][1] = alg.clip(p_list, x_min, y_min, x_max,
-                                                 y_max, algorithm)
-
-            line = fp.readline()
+        for lineno, command in parse_commands(fp):
+            count += 1
+            if isinstance(command, Malformed):
+                malformed += 1
+    elapsed = time.perf_counter() - start
+    print('解析%d条指令（其中%d条无法解析），用时%.3fs，%.0f条/s' %
+          (count, malformed, elapsed, count / elapsed if elapsed else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_file', help='指令文件的路径')
+    parser.add_argument('output_dir',
+                        nargs='?',
+                        help='图像保存目录，指定--throughput时不需要')
+    parser.add_argument('--bezier-tolerance',
+                        type=float,
+                        default=None,
+                        help='Bezier曲线自适应细分的平直度容差（像素），不指定时固定取100个采样点')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        help='saveCanvas时并行光栅化和分块绘制的进程数，默认为1即不使用进程池')
+    parser.add_argument('--throughput',
+                        action='store_true',
+                        help='只解析指令文件不绘制，报告每秒解析的指令条数')
+    parser.add_argument('--profile',
+                        metavar='TRACE_FILE',
+                        help='记录每条指令、saveCanvas各阶段和各图元的耗时、像素数和内存峰值，'
+                        '导出为Chrome trace event JSON，并输出最慢图元的汇总表')
+    parser.add_argument('--unique-pixels',
+                        action='store_true',
+                        help='光栅化结果去除重复的像素点，每个像素只写入一次，结束时报告平均每个像素被算法输出的次数')
+    parser.add_argument('--mmap-threshold',
+                        type=float,
+                        default=DEFAULT_MMAP_THRESHOLD_MB,
+                        metavar='MB',
+                        help='画布超过该大小（MB）时帧缓冲使用磁盘上的内存映射文件，'
+                        '保存时逐段写出BMP，内存占用不随画布增大；默认为1024，为负数时不使用')
+    parser.add_argument('--mmap-dir',
+                        help='内存映射文件所在的目录，默认为系统临时目录；'
+                        '分块绘制时文件在进程异常退出后会留在该目录中')
+    parser.add_argument('--save-queue',
+                        type=int,
+                        default=DEFAULT_SAVE_QUEUE,
+                        metavar='N',
+                        help='saveCanvas只记下当前状态后立即返回，由后台线程按顺序绘制和保存，'
+                        '最多N帧排队，队列满时等待；默认为4，为0时同步保存，开启--profile时总是同步保存')
+    args = parser.parse_args()
+
+    if args.throughput:
+        measure_throughput(args.input_file)
+        return 0
+    if args.output_dir is None:
+        parser.error('the following arguments are required: output_dir')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    pool = None
+    if args.workers > 1:
+        # 先启动共享内存的resource_tracker，使子进程继承同一个；否则子进程各自启动一个，
+        # 退出时会把仍在使用的共享内存当作泄漏删除
+        resource_tracker.ensure_running()
+        pool = ProcessPoolExecutor(max_workers=args.workers)
+    profiler = Profiler() if args.profile else None
+    mmap_threshold = None
+    if args.mmap_threshold >= 0:
+        mmap_threshold = int(args.mmap_threshold * (1 << 20))
+    writer = None
+    if args.save_queue > 0 and profiler is None:
+        writer = FrameWriter(args.save_queue)
+    runner = CommandRunner(args.output_dir, args.bezier_tolerance, pool,
+                           profiler, mmap_threshold, args.mmap_dir, writer,
+                           args.unique_pixels)
+    with open(args.input_file, 'r') as fp:
+        commands = parse_commands(fp)
+        if profiler is not None:
+            commands = profiler.iterate(commands)
+        errors = runner.run(commands, args.input_file)
+    if writer is not None:
+        writer.shutdown()
+    if args.unique_pixels:
+        stats = runner.pixel_stats
+        print('光栅化输出%d个像素，去重后写入%d个，重复率%.2f' %
+              (stats['emitted'], stats['written'],
+               stats['emitted'] / stats['written'] if stats['written'] else 1))
+    if pool is not None:
+        pool.shutdown()
+    if profiler is not None:
+        profiler.write_trace(args.profile)
+        print(profiler.summary())
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,8 +4,11 @@
 import sys
 import os
 import math
+import time
 import numpy as np
-import cg_algorithms as alg
+import cg_batch
+from cg_cache import raster_cache
+from cg_index import GridIndex
 from PIL import Image
 from typing import Optional
 from PyQt5.QtWidgets import (QApplication, QMainWindow, qApp, QGraphicsScene,
@@ -14,8 +17,102 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, qApp, QGraphicsScene,
                              QSlider, QLabel, QPushButton, QColorDialog,
                              QDialog, QFormLayout, QSpinBox, QDialogButtonBox,
                              QFileDialog, QMessageBox)
-from PyQt5.QtGui import QPainter, QMouseEvent, QColor, QPixmap
-from PyQt5.QtCore import QRectF, Qt, QByteArray, QPointF
+from PyQt5.QtGui import (QPainter, QMouseEvent, QColor, QPixmap, QImage,
+                         QPolygon)
+from PyQt5.QtCore import QRectF, Qt, QByteArray, QPointF, QTimer
+
+
+# 包围矩形面积不超过该值的图元缓存为图像，否则缓存为点集
+RASTER_IMAGE_MAX_AREA = 1 << 18
+# 曲线绘制过程中控制点圆的半径，与alg.draw_curve中flag为1时一致
+CONTROL_POINT_RADIUS = 5
+# 拖动时每帧的默认时间预算（秒），超出后曲线和椭圆改为近似绘制
+PREVIEW_FRAME_BUDGET = 1 / 30
+# 近似绘制的采样间隔数范围，见cg_batch.draw_preview；超过上限时恢复完整绘制
+PREVIEW_MIN_SAMPLES = 2
+PREVIEW_MAX_SAMPLES = 64
+# 滚轮缩放停止该时间（毫秒）后恢复完整绘制
+PREVIEW_SETTLE_MS = 200
+
+
+def rect_bounds(rect):
+    """QRectF转换为GridIndex使用的(x_min, y_min, x_max, y_max)"""
+    return rect.left(), rect.top(), rect.right(), rect.bottom()
+
+
+class ItemRaster:
+    """
+    图元光栅化结果的离屏缓存
+
+    一般的图元缓存为包围矩形大小的透明图像，重绘时整块贴图，Qt只处理画面上露出的部分；
+    包围矩形过大时缓存为QPolygon，像素点用一次drawPoints绘制，水平区间作为端点对用一次drawLines绘制
+    """
+    def __init__(self, pixels, color):
+        """
+
+        :param pixels: (numpy.ndarray of int32) 形状为(N, 2)的像素点坐标或形状为(M, 3)的水平区间(y, x_start, x_end)
+        :param color: (QColor) 图元颜色
+        """
+        self.image = None
+        self.points = None
+        self.lines = None
+        self.color = QColor(color)
+        self.rect = QRectF()  # 像素点覆盖的区域
+        if len(pixels) == 0:
+            return
+        spans = pixels.shape[1] == 3
+        if spans:
+            x_min, y_min = pixels[:, 1].min(), pixels[:, 0].min()
+            x_max, y_max = pixels[:, 2].max() - 1, pixels[:, 0].max()
+        else:
+            x_min, y_min = pixels.min(axis=0)
+            x_max, y_max = pixels.max(axis=0)
+        w = int(x_max - x_min) + 1
+        h = int(y_max - y_min) + 1
+        self.rect = QRectF(int(x_min), int(y_min), w, h)
+        if w * h <= RASTER_IMAGE_MAX_AREA:
+            if spans:
+                pixels = cg_batch.to_points(pixels)
+            self.origin = int(x_min), int(y_min)
+            # QImage不复制数据，需要持有缓冲区
+            self._buffer = np.zeros([h, w], np.uint32)
+            self._buffer[pixels[:, 1] - y_min,
+                         pixels[:, 0] - x_min] = self.color.rgba()
+            self.image = QImage(self._buffer.data, w, h, w * 4,
+                                QImage.Format_ARGB32)
+        elif spans:
+            # 每个水平区间对应一条从(x_start, y)到(x_end - 1, y)的线段
+            ends = np.stack([
+                pixels[:, 1], pixels[:, 0], pixels[:, 2] - 1, pixels[:, 0]
+            ],
+                            axis=1).astype(np.int32)
+            self.lines = self._polygon(ends)
+        else:
+            self.points = self._polygon(pixels)
+
+    @staticmethod
+    def _polygon(coords):
+        """把int32坐标数组复制进QPolygon
+
+        :param coords: (numpy.ndarray of int32) 每行若干个(x, y)
+        :return: (QPolygon) 依次包含所有(x, y)的QPolygon
+        """
+        coords = np.ascontiguousarray(coords, np.int32)
+        polygon = QPolygon(coords.size // 2)
+        data = polygon.data()
+        data.setsize(coords.nbytes)
+        np.frombuffer(data, np.int32)[:] = coords.ravel()
+        return polygon
+
+    def draw(self, painter):
+        if self.image is not None:
+            painter.drawImage(*self.origin, self.image)
+        elif self.points is not None:
+            painter.setPen(self.color)
+            painter.drawPoints(self.points)
+        elif self.lines is not None:
+            painter.setPen(self.color)
+            painter.drawLines(self.lines)
 
 
 class MyCanvas(QGraphicsView):
@@ -27,7 +124,22 @@ class MyCanvas(QGraphicsView):
         self.main_window = None
         self.list_widget = None
         self.item_dict = {}
-        self.selected_id = ''
+        self.index = GridIndex()  # 图元包围矩形的空间索引
+        # 本轮事件中需要重绘的区域和被修改的图元，由flush_update合并刷新
+        self.dirty_rect = QRectF()
+        self.edited_items = {}
+        self.update_pending = False
+        self.selected_id = ''  # 最后选中的图元
+        self.selected_ids = {}  # 所有选中的图元，按选中顺序排列，只用键
+        self.rubber_band = None  # 框选时显示的矩形
+        # 拖动中近似绘制的图元、当前的采样间隔数（0表示完整绘制）和本帧开始的时间
+        self.frame_budget = PREVIEW_FRAME_BUDGET
+        self.preview_items = []
+        self.preview_samples = 0
+        self.frame_start = None
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.timeout.connect(self.end_preview)
 
         self.status = ''
         self.temp_algorithm = ''
@@ -46,7 +158,7 @@ class MyCanvas(QGraphicsView):
         #translate,rotate,scale
         self.transform_stage = 0
         self.start_point = []
-        self.start_pos = []
+        self.start_pos = None  # 变换开始时选中图元叠放的顶点和各图元的顶点个数，见cg_batch.stack_points
         self.centre = []
 
         #clip
@@ -55,22 +167,34 @@ class MyCanvas(QGraphicsView):
         #additional_function:
         self.ctrl_state = 0
 
-    def unexpected_operation(self):
+    def unexpected_operation(self, keep_selection=False):
+        """结束正在进行的操作
+
+        :param keep_selection: (bool) 为True时保留选中的图元，用于选中后再切换到平移、旋转、缩放
+        """
         if self.status == 'curve':
             self.curve_end()
             self.num_box.hide()
             self.label.hide()
         elif self.status == 'polygon':
             self.polygon_end()
-        self.clear_selection()
-        self.updateScene([self.sceneRect()])
+        self.end_rubber_band()
+        self.end_preview()
+        if keep_selection:
+            self.transform_stage = 0
+            self.start_point = []
+            self.start_pos = None
+        else:
+            self.clear_selection()
 
     def clear_canvas(self):
         self.unexpected_operation()
         for i in self.item_dict:
             self.scene().removeItem(self.item_dict[i])
         self.item_dict = {}
+        self.index.clear()
         self.selected_id = ''
+        self.selected_ids = {}
         self.status = ''
         self.temp_algorithm = ''
         self.temp_id = ''
@@ -81,7 +205,7 @@ class MyCanvas(QGraphicsView):
         #translate,rotate,scale
         self.transform_stage = 0
         self.start_point = []
-        self.start_pos = []
+        self.start_pos = None
         self.centre = []
         #clip
         self.rect = None
@@ -143,15 +267,15 @@ class MyCanvas(QGraphicsView):
         self.status = 'choose'
 
     def start_translate(self):
-        self.unexpected_operation()
+        self.unexpected_operation(keep_selection=True)
         self.status = 'translate'
 
     def start_rotate(self):
-        self.unexpected_operation()
+        self.unexpected_operation(keep_selection=True)
         self.status = 'rotate'
 
     def start_scale(self):
-        self.unexpected_operation()
+        self.unexpected_operation(keep_selection=True)
         self.status = 'scale'
 
     def start_clip(self, algorithm):
@@ -162,41 +286,237 @@ class MyCanvas(QGraphicsView):
     def finish_draw(self):
         self.temp_id = self.main_window.get_id(1)
         self.temp_item = None
-        self.updateScene([self.sceneRect()])
+
+    def invalidate(self, rect):
+        """登记需要重绘的区域，同一轮事件循环内登记的区域合并后只刷新一次"""
+        self.dirty_rect = self.dirty_rect.united(rect)
+        if not self.update_pending:
+            self.update_pending = True
+            QTimer.singleShot(0, self.flush_update)
+
+    def edit_item(self, item):
+        """在修改图元的参数、flag或选中状态之前调用
+
+        登记图元修改前占据的区域，修改后的区域在flush_update时登记
+        """
+        item.prepareGeometryChange()
+        self.invalidate(item.paint_rect())
+        self.edited_items[id(item)] = item
+
+    def flush_update(self):
+        """刷新登记的区域：被修改图元新旧区域的并集"""
+        for item in self.edited_items.values():
+            if item.scene() is self.scene():
+                self.dirty_rect = self.dirty_rect.united(item.paint_rect())
+        self.edited_items.clear()
+        if not self.dirty_rect.isEmpty():
+            self.updateScene([self.dirty_rect])
+        self.dirty_rect = QRectF()
+        self.update_pending = False
+        self.end_frame()
+
+    def start_preview(self, items):
+        """开始拖动，此后每帧按帧时间预算决定items中的曲线和椭圆是否近似绘制
+
+        :param items: (list of MyItem) 拖动中被修改的图元
+        """
+        self.preview_items = [
+            item for item in items
+            if item.item_type in cg_batch.PREVIEW_ITEM_TYPES
+        ]
+        self.frame_start = None
+
+    def begin_frame(self):
+        """拖动中的一帧开始：把当前的近似程度用于拖动的图元，并开始计时
+
+        同一轮事件循环中的多次鼠标移动只刷新一次，算作一帧
+        """
+        if not self.preview_items or self.frame_start is not None:
+            return
+        self.frame_start = time.perf_counter()
+        for item in self.preview_items:
+            item.preview = self.preview_samples
+
+    def end_frame(self):
+        """一帧结束：超出预算时减少采样，用时不到预算的一半时增加采样，直到恢复完整绘制
+
+        帧时间从处理鼠标移动开始到光栅化完新位置为止，不含Qt贴图的时间
+        """
+        if self.frame_start is None:
+            return
+        elapsed = time.perf_counter() - self.frame_start
+        self.frame_start = None
+        samples = self.preview_samples
+        if self.frame_budget <= 0:
+            samples = 0
+        elif elapsed > self.frame_budget:
+            samples = (PREVIEW_MAX_SAMPLES if samples == 0 else max(
+                PREVIEW_MIN_SAMPLES, samples // 2))
+        elif elapsed < self.frame_budget / 2 and samples != 0:
+            samples *= 2
+            if samples > PREVIEW_MAX_SAMPLES:
+                samples = 0
+        self.preview_samples = samples
+
+    def end_preview(self):
+        """拖动结束，近似绘制的图元恢复完整绘制"""
+        self.preview_timer.stop()
+        for item in self.preview_items:
+            if item.preview:
+                self.edit_item(item)
+                item.preview = 0
+        self.preview_items = []
+        self.frame_start = None
 
     def clear_selection(self):
-        if self.selected_id != '':
-            self.item_dict[self.selected_id].selected = False
+        if self.selected_ids:
+            for item_id in self.selected_ids:
+                self.edit_item(self.item_dict[item_id])
+                self.item_dict[item_id].selected = False
+            self.selected_ids = {}
             self.selected_id = ''
             self.main_window.statusBar().showMessage('')
         self.transform_stage = 0
         self.start_point = []
-        self.start_pos = []
+        self.start_pos = None
         self.centre = []
 
     def selection_changed(self, selected):
         self.main_window.statusBar().showMessage('图元选择： %s' % selected)
-        if self.selected_id != '':
-            self.item_dict[self.selected_id].selected = False
-            self.item_dict[self.selected_id].update()
-        self.selected_id = selected
-        self.item_dict[selected].selected = True
-        self.item_dict[selected].update()
+        for item_id in self.selected_ids:
+            self.edit_item(self.item_dict[item_id])
+            self.item_dict[item_id].selected = False
+        self.selected_ids = {}
+        self.select([selected])
         self.status = ''
-        self.updateScene([self.sceneRect()])
+
+    def select(self, item_ids):
+        """把图元加入选中的图元，变换中心改为所有选中图元的包围矩形中心
+
+        :param item_ids: (list of string) 图元ID
+        """
+        for item_id in item_ids:
+            if item_id not in self.selected_ids:
+                self.edit_item(self.item_dict[item_id])
+                self.item_dict[item_id].selected = True
+                self.selected_ids[item_id] = None
+            self.selected_id = item_id
+        self.selection_updated()
+
+    def deselect(self, item_id):
+        """把图元从选中的图元中去掉
+
+        :param item_id: (string) 图元ID
+        """
+        if item_id not in self.selected_ids:
+            return
+        self.edit_item(self.item_dict[item_id])
+        self.item_dict[item_id].selected = False
+        del self.selected_ids[item_id]
+        self.selected_id = next(reversed(self.selected_ids), '')
+        self.selection_updated()
+
+    def selection_updated(self):
+        """选中的图元改变后更新变换中心和状态栏，此前记下的顶点不再适用"""
+        self.start_pos = None
+        self.update_centre()
+        if not self.selected_ids:
+            self.main_window.statusBar().showMessage('')
+            return
+        if len(self.selected_ids) == 1:
+            self.main_window.statusBar().showMessage('图元选择： %s' %
+                                                     self.selected_id)
+        else:
+            self.main_window.statusBar().showMessage(
+                '图元选择： %d个图元' % len(self.selected_ids))
+
+    def update_centre(self):
+        """按选中图元当前包围矩形的并集重新计算旋转和缩放的中心
+
+        选中的图元被变换后包围矩形随之改变，每次开始和结束变换时都要重新计算
+        """
+        if not self.selected_ids:
+            self.centre = []
+            return
+        rect = QRectF()
+        for item_id in self.selected_ids:
+            rect = rect.united(self.item_dict[item_id].boundingRect())
+        self.centre = [(rect.left() + rect.right()) / 2,
+                       (rect.top() + rect.bottom()) / 2]
+
+    def start_rubber_band(self, x, y):
+        """开始框选，矩形随鼠标拖动"""
+        self.end_rubber_band()
+        self.rubber_band = MyItem('', 'polygon', [[x, y], [x, y], [x, y],
+                                                  [x, y]],
+                                  'DDA',
+                                  color=QColor(0, 0, 255))
+        self.scene().addItem(self.rubber_band)
+        self.edit_item(self.rubber_band)
+
+    def end_rubber_band(self):
+        """结束框选
+
+        :return: (QRectF) 框选的矩形，没有在框选时返回None
+        """
+        if self.rubber_band is None:
+            return None
+        rect = self.rubber_band.boundingRect()
+        self.invalidate(self.rubber_band.paint_rect())
+        self.scene().removeItem(self.rubber_band)
+        self.rubber_band = None
+        return rect
+
+    def stack_selection(self):
+        """记下选中图元的当前顶点，之后每次鼠标移动都从这里开始变换，截断误差不会累积"""
+        self.start_pos = cg_batch.stack_points(
+            [self.item_dict[i].p_list for i in self.selected_ids])
+
+    def transform_selection(self, matrix):
+        """对所有选中的图元作用同一个仿射矩阵，顶点叠放在一个数组中一次计算
+
+        :param matrix: (tuple of float) 仿射矩阵，格式见cg_batch.translate_matrix
+        """
+        points, counts = self.start_pos
+        p_lists = cg_batch.split_points(
+            cg_batch.transform_points(points, matrix), counts)
+        for item_id, p_list in zip(self.selected_ids, p_lists):
+            self.set_p_list(item_id, p_list)
+
+    def add_item(self, item):
+        """把绘制完成的图元加入图元列表和空间索引"""
+        self.item_dict[item.id] = item
+        self.list_widget.addItem(item.id)
+        self.index.insert(item.id, rect_bounds(item.boundingRect()))
+
+    def set_p_list(self, item_id, p_list):
+        """修改图元参数并更新空间索引"""
+        item = self.item_dict[item_id]
+        self.edit_item(item)
+        item.p_list = p_list
+        self.index.update(item_id, rect_bounds(item.boundingRect()))
+
+    def remove_item(self, item_id):
+        """从画布和图元列表中删除图元"""
+        self.deselect(item_id)
+        self.invalidate(self.item_dict[item_id].paint_rect())
+        self.scene().removeItem(self.item_dict.pop(item_id))
+        self.index.remove(item_id)
+        for list_item in self.list_widget.findItems(item_id, Qt.MatchExactly):
+            self.list_widget.takeItem(self.list_widget.row(list_item))
 
     def polygon_end(self):
         if self.temp_item is not None:
+            self.edit_item(self.temp_item)
             self.temp_item.flag = 0
-            self.item_dict[self.temp_id] = self.temp_item
-            self.list_widget.addItem(self.temp_id)
+            self.add_item(self.temp_item)
             self.finish_draw()
 
     def curve_end(self):
         if self.temp_item is not None:
+            self.edit_item(self.temp_item)
             self.temp_item.flag = 0
-            self.item_dict[self.temp_id] = self.temp_item
-            self.list_widget.addItem(self.temp_id)
+            self.add_item(self.temp_item)
             self.curve_stage = 0
             self.curve_pid = -1
             self.finish_draw()
@@ -205,15 +525,11 @@ class MyCanvas(QGraphicsView):
         pos = self.mapToScene(event.localPos().toPoint())
         x = int(pos.x())
         y = int(pos.y())
-        if self.selected_id != '':
-            i = 0
-            for key in self.item_dict:
-                i += 1
-                if self.item_dict[key] and self.item_dict[key].boundingRect(
-                ).contains(x, y):
-                    break
-            if i == len(self.item_dict):
-                self.clear_selection()
+        # 按住Ctrl时点击图元增减选中的图元，框选的图元加入已选中的图元
+        ctrl = bool(event.modifiers() & Qt.ControlModifier)
+        if self.selected_ids and not ctrl and self.index.topmost(x,
+                                                                 y) is None:
+            self.clear_selection()
 
         if self.status == 'line' or self.status == 'ellipse':
             self.temp_item = MyItem(self.temp_id,
@@ -221,6 +537,8 @@ class MyCanvas(QGraphicsView):
                                     self.temp_algorithm,
                                     color=self.main_window.color)
             self.scene().addItem(self.temp_item)
+            self.edit_item(self.temp_item)
+            self.start_preview([self.temp_item])
         elif self.status == 'polygon':
             if event.buttons() == Qt.LeftButton:
                 if self.temp_item is None:
@@ -230,7 +548,9 @@ class MyCanvas(QGraphicsView):
                                             color=self.main_window.color)
                     self.temp_item.flag = 1
                     self.scene().addItem(self.temp_item)
+                    self.edit_item(self.temp_item)
                 else:
+                    self.edit_item(self.temp_item)
                     self.temp_item.p_list.append([x, y])
             elif event.buttons() == Qt.RightButton:
                 self.polygon_end()
@@ -246,48 +566,53 @@ class MyCanvas(QGraphicsView):
                                             self.temp_algorithm,
                                             color=self.main_window.color)
                     self.scene().addItem(self.temp_item)
+                    self.edit_item(self.temp_item)
                 if self.curve_stage == 1:
                     for i in range(len(self.temp_item.p_list)):
                         x0, y0 = self.temp_item.p_list[i]
                         if pow(x - x0, 2) + pow(y - y0, 2) <= 25:
                             self.curve_pid = i
+                self.start_preview([self.temp_item])
             elif event.buttons() == Qt.RightButton:
                 self.curve_end()
         elif self.status == 'choose':
-            for key in self.item_dict:
-                if self.item_dict[key] and self.item_dict[key].boundingRect(
-                ).contains(x, y):
-                    self.selection_changed(key)
-                    self.status = 'choose'
-                    break
+            # 选中光标下最上层的图元，空白处开始框选
+            key = self.index.topmost(x, y)
+            if key is None:
+                self.start_rubber_band(x, y)
+            elif ctrl and key in self.selected_ids:
+                self.deselect(key)
+            elif ctrl:
+                self.select([key])
+            else:
+                self.selection_changed(key)
+                self.status = 'choose'
         elif self.status == 'translate' or self.status == 'rotate' or self.status == 'scale':
             original_status = self.status
             if event.buttons() == Qt.LeftButton:
-                original_selected = self.selected_id
-                for key in self.item_dict:
-                    if self.item_dict[key] and self.item_dict[
-                            key].boundingRect().contains(x, y):
-                        if original_selected != key:
-                            self.selection_changed(key)
-                            self.transform_stage = 1
-                            self.status = original_status
-                            self.start_pos = self.item_dict[
-                                self.selected_id].p_list
-                            self.centre = [
-                                (self.item_dict[key].boundingRect().left() +
-                                 self.item_dict[key].boundingRect().right()) /
-                                2,
-                                (self.item_dict[key].boundingRect().top() +
-                                 self.item_dict[key].boundingRect().bottom()) /
-                                2
-                            ]
-                            break
+                key = self.index.topmost(x, y)
+                if key is None:
+                    self.start_rubber_band(x, y)
+                elif ctrl and key in self.selected_ids:
+                    self.deselect(key)
+                elif ctrl:
+                    self.select([key])
+                elif key not in self.selected_ids:
+                    self.selection_changed(key)
+                    self.status = original_status
+                if self.selected_ids and self.rubber_band is None:
+                    self.transform_stage = 1
+                    self.stack_selection()
+                    self.update_centre()
+                    self.start_preview(
+                        [self.item_dict[i] for i in self.selected_ids])
                 self.start_point = [x, y]
             elif event.buttons() == Qt.RightButton:
                 self.clear_selection()
         elif self.status == 'clip':
             if event.buttons() == Qt.LeftButton:
                 if self.temp_item is not None:
+                    self.invalidate(self.temp_item.paint_rect())
                     self.scene().removeItem(self.temp_item)
                 self.temp_item = MyItem(self.temp_id,
                                         'polygon',
@@ -295,21 +620,29 @@ class MyCanvas(QGraphicsView):
                                         'DDA',
                                         color=QColor(255, 0, 0))
                 self.scene().addItem(self.temp_item)
+                self.edit_item(self.temp_item)
             elif event.buttons() == Qt.RightButton:
                 if self.temp_item is not None:
+                    self.invalidate(self.temp_item.paint_rect())
                     self.scene().removeItem(self.temp_item)
-        self.updateScene([self.sceneRect()])
         super().mousePressEvent(event)
 
     def mouseMoveEvent(self, event: QMouseEvent) -> None:
         pos = self.mapToScene(event.localPos().toPoint())
         x = int(pos.x())
         y = int(pos.y())
-        if self.status == 'line' or self.status == 'ellipse':
+        self.begin_frame()
+        if self.rubber_band is not None:
+            self.edit_item(self.rubber_band)
+            x0, y0 = self.rubber_band.p_list[0]
+            self.rubber_band.p_list = [[x0, y0], [x, y0], [x, y], [x0, y]]
+        elif self.status == 'line' or self.status == 'ellipse':
             if self.temp_item is not None:
+                self.edit_item(self.temp_item)
                 self.temp_item.p_list[1] = [x, y]
         elif self.status == 'curve':
             if self.temp_item is not None:
+                self.edit_item(self.temp_item)
                 if self.curve_stage == 0:
                     x0, y0 = self.temp_item.p_list[0]
                     pnum = len(self.temp_item.p_list)
@@ -322,77 +655,99 @@ class MyCanvas(QGraphicsView):
                 else:  #adjust
                     self.temp_item.p_list[self.curve_pid] = [x, y]
         elif self.status == 'translate':
-            if self.selected_id != '':
-                self.item_dict[self.selected_id].p_list = alg.translate(
-                    self.start_pos, x - self.start_point[0],
-                    y - self.start_point[1])
+            if self.start_pos is not None:
+                self.transform_selection(
+                    cg_batch.translate_matrix(x - self.start_point[0],
+                                              y - self.start_point[1]))
         elif self.status == 'rotate':
-            if self.selected_id != '':
+            if self.start_pos is not None:
                 xr, yr = self.centre
                 r = math.degrees(
                     math.atan2(y - self.start_point[1],
                                x - self.start_point[0]))
-                self.item_dict[self.selected_id].p_list = alg.rotate(
-                    self.start_pos, xr, yr, r)
+                self.transform_selection(cg_batch.rotate_matrix(xr, yr, r))
         elif self.status == 'clip':
             if self.temp_item is not None:
+                self.edit_item(self.temp_item)
                 x0, y0 = self.temp_item.p_list[0]
                 self.temp_item.p_list = [[x0, y0], [x, y0], [x, y], [x0, y]]
 
-        self.updateScene([self.sceneRect()])
         super().mouseMoveEvent(event)
 
 
     def mouseReleaseEvent(self, event: QMouseEvent) -> None:
-        if self.status == 'line' or self.status == 'ellipse':
-            self.item_dict[self.temp_id] = self.temp_item
-            self.list_widget.addItem(self.temp_id)
+        self.end_preview()
+        rect = self.end_rubber_band()
+        if rect is not None:
+            # 选中包围矩形完全在框内的图元
+            ids = [
+                i for i in self.index.query(rect_bounds(rect))
+                if rect.contains(self.item_dict[i].boundingRect())
+            ]
+            if not event.modifiers() & Qt.ControlModifier:
+                self.clear_selection()
+            self.select(ids)
+        elif self.status == 'line' or self.status == 'ellipse':
+            self.add_item(self.temp_item)
             self.finish_draw()
         elif self.status == 'curve':
             if self.temp_item is not None:
+                self.edit_item(self.temp_item)
                 self.temp_item.flag = 1
                 self.curve_stage = 1
         elif self.status == 'translate' or self.status == 'rotate':
-            if self.selected_id != '':
-                self.start_pos = self.item_dict[self.selected_id].p_list
+            if self.start_pos is not None:
+                self.stack_selection()
+                self.update_centre()
         elif self.status == 'clip':
             if self.temp_item is not None:
-                for i in self.item_dict:
-                    if self.item_dict[
-                            i].item_type == 'line' and self.temp_item.boundingRect(
-                            ).intersects(self.item_dict[i].boundingRect()):
-                        rect = QRectF(self.temp_item.boundingRect())
-                        self.item_dict[i].p_list = alg.clip(
-                            self.item_dict[i].p_list, rect.left(), rect.top(),
-                            rect.right(), rect.bottom(), self.temp_algorithm)
+                rect = QRectF(self.temp_item.boundingRect())
+                # 只检查空间索引中与裁剪窗口相交的图元
+                ids = [
+                    i for i in self.index.query(rect_bounds(rect))
+                    if self.item_dict[i].item_type == 'line'
+                ]
+                if ids:
+                    clipped, keep = cg_batch.clip_many(
+                        [self.item_dict[i].p_list for i in ids],
+                        (rect.left(), rect.top(), rect.right(), rect.bottom()),
+                        self.temp_algorithm)
+                    for i, p_list, k in zip(ids, clipped.tolist(), keep):
+                        if k:
+                            self.set_p_list(i, p_list)
+                        else:
+                            self.remove_item(i)
+                self.invalidate(self.temp_item.paint_rect())
                 self.scene().removeItem(self.temp_item)
                 self.temp_item = None
 
-        self.updateScene([self.sceneRect()])
         super().mouseReleaseEvent(event)
 
     def wheelEvent(self, event):
         angle = event.angleDelta()
 
         if self.status == 'scale':
-            if self.selected_id != '':
+            if self.selected_ids:
                 xr, yr = self.centre
                 if angle.y() > 0:
                     s = angle.y() / 100
                 else:
                     s = 100 / abs(angle.y())
-                self.item_dict[self.selected_id].p_list = alg.scale(
-                    self.start_pos, xr, yr, s)
-                self.start_pos = self.item_dict[self.selected_id].p_list
-        self.updateScene([self.sceneRect()])
+                self.stack_selection()
+                # 连续滚动时近似绘制，停止滚动一段时间后恢复
+                if not self.preview_timer.isActive():
+                    self.start_preview(
+                        [self.item_dict[i] for i in self.selected_ids])
+                self.preview_timer.start(PREVIEW_SETTLE_MS)
+                self.begin_frame()
+                self.transform_selection(cg_batch.scale_matrix(xr, yr, s))
         super().wheelEvent(event)
 
     def keyPressEvent(self, event):
         key = event.key()
-        if self.selected_id != '' and key == Qt.Key_Backspace:
-            self.scene().removeItem(self.item_dict[self.selected_id])
-            self.item_dict.pop(self.selected_id)
-            self.selected_id = ''
+        if self.selected_ids and key == Qt.Key_Backspace:
+            for item_id in list(self.selected_ids):
+                self.remove_item(item_id)
         if key == Qt.Key_Control:
             self.ctrl_state = 1
         if self.ctrl_state and key == Qt.Key_C:
@@ -409,8 +764,8 @@ class MyCanvas(QGraphicsView):
         if self.ctrl_state and key == Qt.Key_V:
             if self.temp_item is not None:
                 self.scene().addItem(self.temp_item)
-                self.item_dict[self.temp_id] = self.temp_item
-                self.list_widget.addItem(self.temp_id)
+                self.edit_item(self.temp_item)
+                self.add_item(self.temp_item)
                 self.finish_draw()
 
     def keyReleaseEvent(self, event):
@@ -447,6 +802,11 @@ class MyItem(QGraphicsItem):
         self.selected = False
         self.color = color
         self.flag = flag
+        self.preview = 0  # 拖动中近似绘制的采样间隔数，0表示完整绘制
+        self._raster = None
+        self._raster_key = None
+        self._bounding_rect = None
+        self._bounding_key = None
 
     def copy(item):
         self.id = item.id  # 图元ID
@@ -457,74 +817,59 @@ class MyItem(QGraphicsItem):
         self.color = item.color
         self.flag = 0
 
+    def raster(self) -> ItemRaster:
+        """图元的光栅化缓存，p_list、color、algorithm或flag改变后才重新生成
+
+        绘制过程中p_list可能被原地修改，因此每次按当前参数生成键比较，而不依赖赋值时的通知
+        """
+        key = (tuple(tuple(p) for p in self.p_list), self.algorithm,
+               self.flag, self.color.rgba(), self.preview)
+        if key != self._raster_key:
+            if self.preview and self.item_type in cg_batch.PREVIEW_ITEM_TYPES:
+                # 近似结果只在拖动中用一次，不放入缓存
+                pixels = cg_batch.draw_preview(self.item_type, self.p_list,
+                                               self.algorithm, self.preview,
+                                               self.flag)
+            else:
+                pixels = raster_cache.draw(self.item_type, self.p_list,
+                                           self.algorithm, self.flag)
+            self._raster = ItemRaster(pixels, self.color)
+            self._raster_key = key
+        return self._raster
+
+    def paint_rect(self) -> QRectF:
+        """paint实际绘制的区域，包括控制点和选中时的红框"""
+        return self.raster().rect.united(self.boundingRect()).adjusted(
+            -1, -1, 1, 1)
+
     def paint(self,
               painter: QPainter,
               option: QStyleOptionGraphicsItem,
               widget: Optional[QWidget] = ...) -> None:
-        painter.setPen(self.color)
-        if self.item_type == 'line':
-            item_pixels = alg.draw_line(self.p_list, self.algorithm)
-            for p in item_pixels:
-                painter.drawPoint(*p)
-            if self.selected:
-                painter.setPen(QColor(255, 0, 0))
-                painter.drawRect(self.boundingRect())
-        elif self.item_type == 'polygon':
-            item_pixels = alg.draw_polygon(self.p_list, self.algorithm,
-                                           self.flag)
-            for p in item_pixels:
-                painter.drawPoint(*p)
-            if self.selected:
-                painter.setPen(QColor(255, 0, 0))
-                painter.drawRect(self.boundingRect())
-        elif self.item_type == 'ellipse':
-            item_pixels = alg.draw_ellipse(self.p_list)
-            for p in item_pixels:
-                painter.drawPoint(*p)
-            if self.selected:
-                painter.setPen(QColor(255, 0, 0))
-                painter.drawRect(self.boundingRect())
-        elif self.item_type == 'curve':
-            item_pixels = alg.draw_curve(self.p_list, self.algorithm,
-                                         self.flag)
-            for p in item_pixels:
-                painter.drawPoint(*p)
-            if self.selected:
-                painter.setPen(QColor(255, 0, 0))
-                painter.drawRect(self.boundingRect())
+        self.raster().draw(painter)
+        if self.selected:
+            painter.setPen(QColor(255, 0, 0))
+            painter.drawRect(self.boundingRect())
 
     def boundingRect(self) -> QRectF:
-        if self.item_type == 'line' or self.item_type == 'ellipse':
-            x0, y0 = self.p_list[0]
-            x1, y1 = self.p_list[1]
-            x = min(x0, x1)
-            y = min(y0, y1)
-            w = max(x0, x1) - x
-            h = max(y0, y1) - y
-            return QRectF(x - 1, y - 1, w + 2, h + 2)
-        elif self.item_type == 'polygon':
-            x_min, y_min = self.p_list[0]
-            x_max, y_max = self.p_list[0]
-            for p in self.p_list:
-                x_min = min(x_min, p[0])
-                y_min = min(y_min, p[1])
-                x_max = max(x_max, p[0])
-                y_max = max(y_max, p[1])
-            w = x_max - x_min
-            h = y_max - y_min
-            return QRectF(x_min - 1, y_min - 1, w + 2, h + 2)
-        elif self.item_type == 'curve':
-            res = alg.draw_curve(self.p_list, self.algorithm)
-            x_min, y_min = res[0]
-            x_max, y_max = res[0]
-            for p in res:
-                x_min = min(x_min, p[0])
-                y_min = min(y_min, p[1])
-                x_max = max(x_max, p[0])
-                y_max = max(y_max, p[1])
-            w = x_max - x_min
-            h = y_max - y_min
-            return QRectF(x_min - 1, y_min - 1, w + 2, h + 2)
+        """包围矩形，由顶点或控制点直接算出并缓存，p_list或flag改变后重新计算
+
+        Bezier曲线和B样条曲线都落在控制点的凸包内，因此不需要光栅化曲线
+        """
+        key = (tuple(tuple(p) for p in self.p_list), self.flag)
+        if key != self._bounding_key:
+            xs = [p[0] for p in self.p_list]
+            ys = [p[1] for p in self.p_list]
+            margin = 1
+            if self.item_type == 'curve' and self.flag == 1:
+                # 绘制过程中控制点画成半径为CONTROL_POINT_RADIUS的圆
+                margin += CONTROL_POINT_RADIUS
+            x_min, y_min = min(xs), min(ys)
+            self._bounding_rect = QRectF(x_min - margin, y_min - margin,
+                                         max(xs) - x_min + 2 * margin,
+                                         max(ys) - y_min + 2 * margin)
+            self._bounding_key = key
+        return QRectF(self._bounding_rect)
 
 
 class MainWindow(QMainWindow):
@@ -560,6 +905,7 @@ class MainWindow(QMainWindow):
         set_pen_act = file_menu.addAction('设置画笔')
         reset_canvas_act = file_menu.addAction('重置画布')
         save_canvas_act = file_menu.addAction('保存画布')
+        set_budget_act = file_menu.addAction('设置预览帧时间')
         exit_act = file_menu.addAction('退出')
         draw_menu = menubar.addMenu('绘制')
         line_menu = draw_menu.addMenu('线段')
@@ -586,6 +932,7 @@ class MainWindow(QMainWindow):
         set_pen_act.triggered.connect(self.set_pen_action)
         reset_canvas_act.triggered.connect(self.reset_canvas_action)
         save_canvas_act.triggered.connect(self.save_canvas_action)
+        set_budget_act.triggered.connect(self.set_budget_action)
         exit_act.triggered.connect(qApp.quit)
         line_naive_act.triggered.connect(self.line_naive_action)
         line_dda_act.triggered.connect(self.line_dda_action)
@@ -675,6 +1022,27 @@ class MainWindow(QMainWindow):
                 self.setMaximumWidth(self.width)
                 self.resize(self.width, self.height)
 
+    def set_budget_action(self):
+        self.statusBar().showMessage('设置预览帧时间')
+        dialog = QDialog()
+        dialog.setWindowTitle('设置预览帧时间')
+        budget_box = QSpinBox(dialog)
+        budget_box.setRange(0, 1000)
+        budget_box.setSuffix(' ms')
+        budget_box.setValue(round(self.canvas_widget.frame_budget * 1000))
+        confirm_box = QDialogButtonBox(QDialogButtonBox.Ok
+                                       | QDialogButtonBox.Cancel)
+        confirm_box.accepted.connect(dialog.accept)
+        confirm_box.rejected.connect(dialog.reject)
+        formlayout = QFormLayout(dialog)
+        formlayout.addRow('帧时间(0为关闭):', budget_box)
+        formlayout.addRow(confirm_box)
+
+        if dialog.exec():
+            self.canvas_widget.frame_budget = budget_box.value() / 1000
+            self.canvas_widget.preview_samples = 0
+        self.statusBar().showMessage('空闲')
+
     def save_canvas_action(self):
         self.statusBar().showMessage('保存画布')
         dialog = QFileDialog()
@@ -742,19 +1110,16 @@ class MainWindow(QMainWindow):
         self.canvas_widget.start_translate()
         self.statusBar().showMessage('平移')
         self.list_widget.clearSelection()
-        self.canvas_widget.clear_selection()
 
     def rotate_action(self):
         self.canvas_widget.start_rotate()
         self.statusBar().showMessage('旋转')
         self.list_widget.clearSelection()
-        self.canvas_widget.clear_selection()
 
     def scale_action(self):
         self.canvas_widget.start_scale()
         self.statusBar().showMessage('缩放')
         self.list_widget.clearSelection()
-        self.canvas_widget.clear_selection()
 
     def clip_cohen_sutherland_action(self):
         self.canvas_widget.start_clip('Cohen-Sutherland')
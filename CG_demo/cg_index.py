@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# GUI使用的图元空间索引
+import math
+
+# 网格单元的边长（像素）
+DEFAULT_CELL_SIZE = 64
+
+
+class GridIndex:
+    """
+    均匀网格空间索引
+
+    每个图元按包围矩形登记到它覆盖的所有网格单元中，矩形查询和点查询只检查相关单元里的图元。
+    图元按插入顺序编号，编号大的在上层，与QGraphicsScene中同一z值的图元的绘制顺序一致
+    """
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        """
+
+        :param cell_size: (int) 网格单元的边长
+        """
+        self.cell_size = cell_size
+        self._cells = {}  # (列, 行) -> 图元ID集合
+        self._items = {}  # 图元ID -> (包围矩形, 覆盖的单元范围, 插入序号)
+        self._order = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item_id):
+        return item_id in self._items
+
+    def _cell_range(self, rect):
+        x_min, y_min, x_max, y_max = rect
+        s = self.cell_size
+        return (math.floor(x_min / s), math.floor(y_min / s),
+                math.floor(x_max / s), math.floor(y_max / s))
+
+    def _cells_of(self, cell_range):
+        c0, r0, c1, r1 = cell_range
+        for c in range(c0, c1 + 1):
+            for r in range(r0, r1 + 1):
+                yield c, r
+
+    def insert(self, item_id, rect):
+        """登记图元，已登记的图元更新包围矩形并保持原来的上下层次
+
+        :param item_id: (string) 图元ID
+        :param rect: (tuple of float: (x_min, y_min, x_max, y_max)) 图元的包围矩形
+        """
+        old = self._items.get(item_id)
+        if old is not None:
+            order = old[2]
+            self.remove(item_id)
+        else:
+            order = self._order
+            self._order += 1
+        cell_range = self._cell_range(rect)
+        for cell in self._cells_of(cell_range):
+            self._cells.setdefault(cell, set()).add(item_id)
+        self._items[item_id] = (tuple(rect), cell_range, order)
+
+    def update(self, item_id, rect):
+        """更新图元的包围矩形
+
+        :param item_id: (string) 图元ID
+        :param rect: (tuple of float: (x_min, y_min, x_max, y_max)) 图元新的包围矩形
+        """
+        old = self._items.get(item_id)
+        if old is not None and self._cell_range(rect) == old[1]:
+            self._items[item_id] = (tuple(rect), old[1], old[2])
+        else:
+            self.insert(item_id, rect)
+
+    def remove(self, item_id):
+        """删除图元，图元不存在时忽略
+
+        :param item_id: (string) 图元ID
+        """
+        old = self._items.pop(item_id, None)
+        if old is None:
+            return
+        for cell in self._cells_of(old[1]):
+            ids = self._cells[cell]
+            ids.discard(item_id)
+            if not ids:
+                del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+        self._items.clear()
+        self._order = 0
+
+    def query(self, rect):
+        """查询包围矩形与给定矩形相交的图元
+
+        :param rect: (tuple of float: (x_min, y_min, x_max, y_max)) 查询矩形
+        :return: (list of string) 图元ID，按插入顺序从下到上排列
+        """
+        x_min, y_min, x_max, y_max = rect
+        c0, r0, c1, r1 = self._cell_range(rect)
+        if (c1 - c0 + 1) * (r1 - r0 + 1) > len(self._items):
+            # 查询范围覆盖的单元比图元还多时直接逐个检查
+            candidates = self._items
+        else:
+            candidates = set()
+            for cell in self._cells_of((c0, r0, c1, r1)):
+                candidates.update(self._cells.get(cell, ()))
+        result = []
+        for item_id in candidates:
+            (a0, b0, a1, b1), _, order = self._items[item_id]
+            if a0 <= x_max and x_min <= a1 and b0 <= y_max and y_min <= b1:
+                result.append((order, item_id))
+        return [item_id for _, item_id in sorted(result)]
+
+    def at(self, x, y):
+        """查询包围矩形包含给定点的图元
+
+        :param x: (float) 点的x坐标
+        :param y: (float) 点的y坐标
+        :return: (list of string) 图元ID，从上到下排列
+        """
+        s = self.cell_size
+        result = []
+        for item_id in self._cells.get((math.floor(x / s), math.floor(y / s)),
+                                       ()):
+            (a0, b0, a1, b1), _, order = self._items[item_id]
+            if a0 <= x <= a1 and b0 <= y <= b1:
+                result.append((order, item_id))
+        return [item_id for _, item_id in sorted(result, reverse=True)]
+
+    def topmost(self, x, y):
+        """查询包围矩形包含给定点的最上层图元
+
+        :param x: (float) 点的x坐标
+        :param y: (float) 点的y坐标
+        :return: (string) 图元ID，没有时返回None
+        """
+        ids = self.at(x, y)
+        return ids[0] if ids else None
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# CLI性能剖析：记录指令、saveCanvas各阶段和各图元的耗时、像素数和内存峰值
+import os
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# 汇总表中列出的最慢图元个数
+SLOWEST_ITEMS = 10
+
+
+class Profiler:
+    """
+    记录嵌套的计时区间，导出为Chrome trace event格式（chrome://tracing或Perfetto可直接打开）
+
+    内存峰值由tracemalloc统计，包括numpy数组；每个区间的峰值包含其内部嵌套区间的峰值
+    """
+    def __init__(self, trace_memory=True):
+        """
+
+        :param trace_memory: (bool) 是否用tracemalloc统计内存峰值，统计本身会使程序变慢
+        """
+        self.events = []
+        self.trace_memory = trace_memory
+        self.parse_seconds = 0.0
+        self.parse_count = 0
+        self._stack = []  # 未结束区间的内存峰值
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _peak(self):
+        if not self.trace_memory:
+            return 0
+        return tracemalloc.get_traced_memory()[1]
+
+    @contextmanager
+    def span(self, name, cat, **args):
+        """计时区间
+
+        :param name: (string) 区间名称
+        :param cat: (string) 区间类别，'command'、'phase'、'item'
+        :param args: 附加信息，区间内可以继续向产生的dict中添加
+        :return: (dict) 区间的附加信息
+        """
+        # tracemalloc只有一个全局峰值，进入子区间前把父区间目前的峰值记下再清零
+        if self._stack:
+            self._stack[-1] = max(self._stack[-1], self._peak())
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self._stack.append(0)
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            peak = max(self._stack.pop(), self._peak())
+            if self._stack:
+                self._stack[-1] = max(self._stack[-1], peak)
+            if self.trace_memory:
+                args['peak_memory'] = peak
+            self.events.append({
+                'name': name,
+                'cat': cat,
+                'ph': 'X',
+                'ts': (start - self._origin) * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': self._pid,
+                'tid': 0,
+                'args': args
+            })
+
+    def iterate(self, iterable):
+        """逐项取出iterable的元素，累计取元素的用时，用于统计惰性解析指令的耗时
+
+        :param iterable: (iterable) 例如parse_commands产生的生成器
+        :return: (generator) 与iterable相同的元素
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                self.parse_seconds += time.perf_counter() - start
+                return
+            self.parse_seconds += time.perf_counter() - start
+            self.parse_count += 1
+            yield value
+
+    def write_trace(self, path):
+        """导出Chrome trace event JSON
+
+        :param path: (string) 输出文件路径
+        """
+        with open(path, 'w') as fp:
+            json.dump(
+                {
+                    'traceEvents': self.events,
+                    'displayTimeUnit': 'ms',
+                    'otherData': {
+                        'parse_seconds': self.parse_seconds,
+                        'parsed_commands': self.parse_count
+                    }
+                },
+                fp,
+                ensure_ascii=False)
+
+    def _totals(self, events, key):
+        """按key分组累计耗时、次数、像素数和内存峰值"""
+        totals = {}
+        for e in events:
+            t = totals.setdefault(key(e), [0.0, 0, 0, 0])
+            t[0] += e['dur'] / 1e6
+            t[1] += 1
+            t[2] += e['args'].get('pixels', 0)
+            t[3] = max(t[3], e['args'].get('peak_memory', 0))
+        return sorted(totals.items(), key=lambda kv: -kv[1][0])
+
+    def summary(self, top=SLOWEST_ITEMS):
+        """汇总表
+
+        :param top: (int) 列出的最慢图元个数
+        :return: (string) 按指令类型、saveCanvas阶段、图元类型和算法汇总的耗时，以及最慢的图元
+        """
+        lines = ['解析: %d条指令 %.3fs' % (self.parse_count, self.parse_seconds)]
+        header = '%-28s %10s %8s %12s %12s' % ('', '耗时(s)', '次数', '像素数', '内存峰值(KB)')
+
+        def table(title, rows):
+            lines.append('')
+            lines.append(title)
+            lines.append(header)
+            for name, (seconds, count, pixels, peak) in rows:
+                lines.append('%-28s %10.4f %8d %12d %12.1f' %
+                             (name, seconds, count, pixels, peak / 1024))
+
+        by_cat = {}
+        for e in self.events:
+            by_cat.setdefault(e['cat'], []).append(e)
+        table('指令', self._totals(by_cat.get('command', []),
+                                 lambda e: e['name']))
+        phases = self._totals(by_cat.get('phase', []), lambda e: e['name'])
+        # framebuffer阶段中除去光栅化的部分即写入帧缓冲的时间
+        durations = dict((name, t[0]) for name, t in phases)
+        if 'framebuffer' in durations:
+            phases.append(('(canvas writes)', [
+                durations['framebuffer'] - durations.get('rasterize', 0), 0,
+                0, 0
+            ]))
+        table('saveCanvas阶段', phases)
+        items = by_cat.get('item', [])
+        table(
+            '图元类型/算法',
+            self._totals(
+                items, lambda e: '%s/%s' %
+                (e['args']['type'], e['args']['algorithm'] or '-')))
+
+        lines.append('')
+        lines.append('最慢的%d个图元' % min(top, len(items)))
+        lines.append('%-12s %-10s %-18s %10s %10s %6s' %
+                     ('图元', '类型', '算法', '耗时(ms)', '像素数', '缓存'))
+        for e in sorted(items, key=lambda e: -e['dur'])[:top]:
+            args = e['args']
+            lines.append('%-12s %-10s %-18s %10.3f %10d %6s' %
+                         (e['name'], args['type'], args['algorithm'] or '-',
+                          e['dur'] / 1e3, args.get('pixels', 0),
+                          '命中' if args.get('cached') else ''))
+        return '\n'.join(lines)